@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""Counts errors per category and system in `results.csv`, and
+tests whether the differences between each pair of systems are
+significant (Fisher's exact test or chi-square test, optionally
+corrected for multiple comparisons).
+
+Output is written to STDOUT as CSV, in the format of
+`results.final.csv`. With `--store`, error annotations are read from a store
+built by `ranking/scripts/store.py` instead of `items.csv` and `results.csv`.
+"""
+
+import os
+import sys
+import csv
+import math
+from collections import defaultdict
+from itertools import combinations
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ranking', 'scripts'))
+from store import open_store, error_origins, NON_CATEGORIES
+
+
+# categories that are the sum of others
+AGGREGATES = {
+    'Incorrect Word': ['Incorrect Word (Semantics)', 'Incorrect Word (Grammaticality)'],
+    'Missing Word': ['Missing Word (Semantics)', 'Missing Word (Grammaticality)'],
+}
+SUBCATEGORY_PREFIX = 'NE - ' # subcategories of `Named Entity`
+ANY = 'Any' # number of items with at least one error
+TOTAL = 'Total' # number of errors in all top-level categories
+
+
+def is_subcategory(category):
+    return category.startswith(SUBCATEGORY_PREFIX) or \
+           any(category in members for members in AGGREGATES.values())
+
+
+def stars(p):
+    """Significance codes as in R's `gtools::stars.pval`."""
+    for threshold, code in [(0.001, '***'), (0.01, '**'), (0.05, '*'), (0.1, '.')]:
+        if p < threshold:
+            return code
+    return ' '
+
+
+class LogFactorials:
+    """Log factorials, computed once up to the largest number needed."""
+
+    def __init__(self):
+        self.table = [0.0]
+
+    def __getitem__(self, n):
+        while len(self.table) <= n:
+            self.table.append(self.table[-1] + math.log(len(self.table)))
+        return self.table[n]
+
+
+log_factorial = LogFactorials()
+
+
+def fisher(a, b, c, d):
+    """Two-sided p-value of Fisher's exact test for the 2x2 table
+    [[a, b], [c, d]], computed as in R's `fisher.test`."""
+    row1, col1, n = a + b, a + c, a + b + c + d
+    constant = log_factorial[row1] + log_factorial[c + d] + log_factorial[col1] + \
+               log_factorial[b + d] - log_factorial[n]
+    def log_p(x): # probability of x in the top left cell
+        return constant - log_factorial[x] - log_factorial[row1 - x] - \
+               log_factorial[col1 - x] - log_factorial[n - row1 - col1 + x]
+    observed = log_p(a)
+    p = 0.0
+    for x in range(max(0, row1 + col1 - n), min(row1, col1) + 1):
+        lp = log_p(x)
+        if lp <= observed + math.log1p(1e-7):
+            p += math.exp(lp)
+    return min(1.0, p)
+
+
+def chi_square(a, b, c, d):
+    """P-value of Pearson's chi-square test with Yates' continuity correction
+    for the 2x2 table [[a, b], [c, d]], as in R's `chisq.test`."""
+    n = a + b + c + d
+    denominator = (a + b) * (c + d) * (a + c) * (b + d)
+    if denominator == 0:
+        return 1.0
+    difference = max(0, abs(a * d - b * c) - n / 2)
+    statistic = n * difference ** 2 / denominator
+    return math.erfc(math.sqrt(statistic / 2)) # survival function of chi2 with 1 df
+
+
+TESTS = {'fisher': fisher, 'chi-square': chi_square}
+
+
+def holm(p_values):
+    """Holm-Bonferroni adjusted p-values."""
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
+    adjusted = [0.0] * len(p_values)
+    running = 0.0
+    for rank, i in enumerate(order):
+        running = max(running, min(1.0, (len(p_values) - rank) * p_values[i]))
+        adjusted[i] = running
+    return adjusted
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (false discovery rate)."""
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i], reverse=True)
+    adjusted = [0.0] * len(p_values)
+    running = 1.0
+    for rank, i in enumerate(order):
+        running = min(running, len(p_values) * p_values[i] / (len(p_values) - rank))
+        adjusted[i] = running
+    return adjusted
+
+
+CORRECTIONS = {
+    'none': lambda p_values: p_values,
+    'bonferroni': lambda p_values: [min(1.0, p * len(p_values)) for p in p_values],
+    'holm': holm,
+    'fdr': benjamini_hochberg,
+}
+
+
+def short_name(system):
+    return system[len('human_'):] if system.startswith('human_') else system
+
+
+parser = ArgumentParser(description='Counts errors per category and system, and tests '
+                                    'the significance of differences between systems.')
+parser.add_argument('--items', default='items.csv',
+                    help='The annotated items, mapping examples to systems.')
+parser.add_argument('--results', default='results.csv',
+                    help='The error annotations, one row per item and example.')
+parser.add_argument('--store', metavar='DIR[#STUDY]',
+                    help='Read error annotations from a store (of all studies, or of STUDY) instead of '
+                         '--items and --results.')
+parser.add_argument('--test', choices=sorted(TESTS), default='fisher',
+                    help='Significance test (default: fisher).')
+parser.add_argument('--correction', choices=sorted(CORRECTIONS), default='none',
+                    help='Correction for multiple comparisons, over all categories '
+                         'and system pairs (default: none).')
+args = parser.parse_args()
+
+errors = defaultdict(lambda: defaultdict(int)) # category => system => count
+num_items = defaultdict(int) # system => number of annotated items
+if args.store:
+    # count errors with the row indexes of the store
+    store, study = open_store(args.store, all_studies=True)
+    categories = store.categories
+    conditions = {'study': study} if study is not None else {}
+    for system in store.dictionaries['origin'].values:
+        rows = store.errors.select(origin=system, **conditions)
+        if not rows:
+            continue
+        num_items[system] = len(rows)
+        counts, any_error = store.error_counts(rows)
+        for category in categories:
+            errors[category][system] = counts[category]
+        errors[ANY][system] = any_error
+else:
+    try:
+        # map examples to systems
+        with open(args.items) as f:
+            origins = error_origins(csv.DictReader(f)) # (item_id, example) => system
+
+        # count errors
+        with open(args.results) as f:
+            results = csv.DictReader(f)
+            categories = [c for c in results.fieldnames if c not in NON_CATEGORIES]
+            for row in results:
+                system = origins[(row['Item'], row['Example'])]
+                num_items[system] += 1
+                flags = {c: row[c].strip() == '1' for c in categories}
+                for category in categories:
+                    errors[category][system] += flags[category]
+                errors[ANY][system] += any(flags.values())
+    except OSError as e:
+        parser.error("can't read {0}: {1}".format(e.filename, e.strerror))
+systems = sorted(num_items)
+for aggregate, members in AGGREGATES.items():
+    for system in systems:
+        errors[aggregate][system] = sum(errors[m][system] for m in members if m in errors)
+top_level = [c for c in categories if not is_subcategory(c)] + \
+            [a for a in AGGREGATES if any(m in categories for m in AGGREGATES[a])]
+for system in systems:
+    errors[TOTAL][system] = sum(errors[c][system] for c in top_level)
+
+# order categories: aggregates before their members
+rows = []
+for category in categories:
+    for aggregate, members in AGGREGATES.items():
+        if members[0] == category:
+            rows.append(aggregate)
+    rows.append(category)
+rows.extend([ANY, TOTAL])
+
+# test all pairs of systems in all categories
+pairs = list(combinations(systems, 2))
+p_values = []
+for category in rows:
+    for system1, system2 in pairs:
+        e1, e2 = errors[category][system1], errors[category][system2]
+        n1, n2 = num_items[system1], num_items[system2]
+        if category == TOTAL:
+            n1, n2 = n1 * len(top_level), n2 * len(top_level)
+        p_values.append(TESTS[args.test](e1, n1 - e1, e2, n2 - e2))
+p_values = CORRECTIONS[args.correction](p_values)
+
+# write results
+writer = csv.writer(sys.stdout, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+writer.writerow(['Error.Category'] + systems +
+                ['{0}_{1}'.format(short_name(s1), short_name(s2)) for s1, s2 in pairs])
+for i, category in enumerate(rows):
+    significance = [stars(p) for p in p_values[i * len(pairs):(i + 1) * len(pairs)]]
+    writer.writerow([category] + [errors[category][s] for s in systems] + significance)
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 
 """Combines experimental items in `items.csv` with results
-stored in `results/documents` and `results/sentences`.
+stored in `results/documents` and `results/sentences`, or with the
+items and ratings in a store (see `scripts/store.py`).
+
+Ratings are kept in an index (`ratings.sqlite`) that is updated
+with new or changed rating files only. Raters are numbered in
+alphabetical order of their file names.
 
 Output is written to STDOUT as CSV.
 """
 
+import os
 import sys
 import csv
-import glob
 from collections import defaultdict
-from argparse import ArgumentParser, FileType
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from tables import read_table, CountingStream
+from ratings_index import RatingsIndex, ratings_files
+from store import is_store, open_store, StoreRatings
+import instrumentation
 
 
 VALID_RATINGS = ['A', 'B', 'X']
@@ -20,60 +31,98 @@ FIELDNAME = {
 }
 
 
-def read_ratings(ratings_file):
-    ratings = [] # (file_id, task_order, condition_st, rating)
-    with open(ratings_file) as rf:
-        for r in csv.DictReader(rf):
-            file_id, file_order = r['ID'].split('-')
-            condition_st, file_id, level = file_id[0], file_id[1:], file_id[2]
-            rating = r['Judgement']
-            ratings.append((file_id, file_order, condition_st, rating))
-    return ratings
-
-
-def add_results(items, results_folder):
-    for ratings_file in glob.glob(results_folder + '*.csv'):
-        for file_id, file_order, condition_st, rating in read_ratings(ratings_file):
-            item = items[file_id][file_order]
-            origin = item[rating  + '_origin'] if rating != 'X' else 'tie'
-            field = FIELDNAME[condition_st] + '_rater'
-            field = field + '1' if field + '1' not in item else field + '2'
-            item[field] = origin
-        
-
-parser = ArgumentParser(description='Combines experimental items with results.')
-parser.add_argument('--items', type=FileType('r'), required=False, default='items.csv',
-                    help='The original items.')
-parser.add_argument('--sents', type=str, required=False, default='results/sentences/',
-                    help='Folder containing stentence-level results.')
-parser.add_argument('--docs', type=str, required=False, default='results/documents/',
-                    help='Folder containing document-level results.')
-args = parser.parse_args()
-
-# read experimental items into memory
-items = defaultdict(dict) # task_id => task_order => item (entire csv row)
-for item in csv.DictReader(args.items):
-    items[item['file_id']][item['file_order']] = item
-
-# add sentence-level results
-add_results(items, args.sents)
-
-# add document-level results
-add_results(items, args.docs)
-
-# write results
-fieldnames = [
-    'file_id', 'file_order', 'task_id', 'task_order', 'wmt_article', 'wmt_line', 'level',
-    FIELDNAME['m'] + '_rater1', FIELDNAME['m'] + '_rater2', 
-    FIELDNAME['b'] + '_rater1', FIELDNAME['b'] + '_rater2', 
-    'A_origin', 'B_origin', 'src', 'A', 'B',
-]
-writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-writer.writeheader()
-for _, the_items in items.items():
-    for _, item in the_items.items():
-        item['level'] = 'sentence' if item['file_id'].endswith('s') else 'document'
-        writer.writerow(item)
-
-
-
+def add_results(items, index):
+    for file_id, file_order, condition_st, rater, rating in index.ratings():
+        item = items[file_id][file_order]
+        origin = item[rating  + '_origin'] if rating != 'X' else 'tie'
+        field = FIELDNAME[condition_st] + '_rater'
+        n = 1
+        while field + str(n) in item:
+            n += 1
+        item[field + str(n)] = origin
+
+
+def find_ratings(sents='results/sentences/', docs='results/documents/'):
+    """The rating files in the folders `sents` and `docs` (if they exist)."""
+    return ratings_files([folder for folder in (sents, docs) if os.path.isdir(folder)])
+
+
+def combine_results(rows, ratings, index_path=':memory:'):
+    """Adds the ratings in the files `ratings` to the experimental items
+    `rows`. Ratings can also be given as an index (`RatingsIndex` or
+    `StoreRatings`). Returns the output fieldnames and a list of rows."""
+    items = defaultdict(dict) # task_id => task_order => item (entire csv row)
+    for item in rows:
+        items[item['file_id']][item['file_order']] = dict(item)
+
+    # update index with sentence- and document-level results, and add them
+    if isinstance(ratings, (list, tuple)):
+        index = RatingsIndex(index_path)
+        index.update(ratings)
+    else:
+        index = ratings
+    add_results(items, index)
+    num_raters = max(2, index.max_raters())
+    index.close()
+
+    fieldnames = [
+        'file_id', 'file_order', 'task_id', 'task_order', 'wmt_article', 'wmt_line', 'level',
+    ] + [
+        FIELDNAME[c] + '_rater' + str(n) for c in 'mb' for n in range(1, num_raters + 1)
+    ] + [
+        'A_origin', 'B_origin', 'src', 'A', 'B',
+    ]
+    results = []
+    for _, the_items in items.items():
+        for _, item in the_items.items():
+            item['level'] = 'sentence' if item['file_id'].endswith('s') else 'document'
+            results.append(item)
+    return fieldnames, results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Combines experimental items with results.')
+    parser.add_argument('--items', required=False, default='items.csv',
+                        help='The original items (CSV or SQLite), or a store, from which '
+                             'ratings are read as well.')
+    parser.add_argument('--sents', type=str, required=False, default='results/sentences/',
+                        help='Folder containing stentence-level results.')
+    parser.add_argument('--docs', type=str, required=False, default='results/documents/',
+                        help='Folder containing document-level results.')
+    parser.add_argument('--index', type=str, required=False, default='ratings.sqlite',
+                        help='The ratings index, created if it does not exist. Use '
+                             ':memory: to read all ratings from scratch.')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instruments = instrumentation.from_arguments(__file__, args)
+    store = None
+    if is_store(args.items):
+        try:
+            store = open_store(args.items) # items of several studies must not be mixed
+        except ValueError as e:
+            parser.error(str(e))
+
+    with instruments.stage('read_items') as stage:
+        rows = list(read_table(args.items))
+        stage.rows = len(rows)
+    with instruments.stage('combine') as stage:
+        if store:
+            ratings = StoreRatings(*store)
+        else:
+            ratings = find_ratings(args.sents, args.docs)
+        try:
+            fieldnames, results = combine_results(rows, ratings, args.index)
+        except ValueError as e:
+            parser.error(str(e))
+        stage.rows = len(results)
+
+    # write results
+    with instruments.stage('write') as stage:
+        out = CountingStream(sys.stdout)
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
+        writer.writeheader()
+        for item in results:
+            writer.writerow(item)
+        stage.rows = len(results)
+        stage.bytes_written = out.count
+    instruments.close(args.metrics)
@@ -1,14 +1,14 @@
 #!/usr/bin/env bash
 
-mkdir -p output/html
-
-./scripts/combine_data.py \
-  input/newstest2017-zhen-src.zh.sgm \
-  input/microsoft-mt-combo6.txt \
-  input/microsoft-ht.txt \
-  input/graham-ht.csv \
-  > data.csv
-
-./scripts/create_experiment.py data.csv > items.csv
-
-./scripts/create_html.py items.csv -d output/html
+# Stages whose inputs have not changed are taken from .pipeline-cache.
+./scripts/pipeline.py \
+  --src input/newstest2017-zhen-src.zh.sgm \
+  --system mt=input/microsoft-mt-combo6.txt \
+  --system human_a=input/microsoft-ht.txt \
+  --system human_b=input/graham-ht.csv \
+  --sampling rejection \
+  --data data.csv \
+  --items items.csv \
+  -d output/html \
+  --cache .pipeline-cache \
+  "$@"
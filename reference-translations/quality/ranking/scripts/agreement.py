@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""Computes inter-rater agreement and spam catch rates from the
+ratings in `results/documents` and `results/sentences`.
+
+Ratings are kept in the same incremental index as in
+`combine_results.py` (`ratings.sqlite`), so only new or changed
+rating files are read. Agreement is computed from contingency tables
+aggregated in the index: judgement counts per item for Fleiss' kappa
+and Krippendorff's alpha (nominal), and one judgement × judgement
+table per pair of raters who rated the same items for Cohen's kappa.
+Spam items are excluded from agreement.
+
+Output is written to STDOUT as CSV, one row per measure.
+"""
+
+import os
+import sys
+import csv
+from collections import defaultdict
+from argparse import ArgumentParser
+
+from ratings_index import RatingsIndex
+from results import read_items
+from store import LEVELS
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from combine_results import find_ratings, FIELDNAME
+
+
+def fleiss_kappa(items):
+    """Fleiss' kappa for a list of items, each a dict of judgement =>
+    number of raters. Items may have different numbers of raters; items with
+    less than two raters are ignored."""
+    items = [counts for counts in items if sum(counts.values()) > 1]
+    if not items:
+        return None
+    totals = defaultdict(int)
+    agreement = 0.0
+    num_ratings = 0
+    for counts in items:
+        n = sum(counts.values())
+        agreement += sum(c * (c - 1) for c in counts.values()) / (n * (n - 1))
+        num_ratings += n
+        for judgement, c in counts.items():
+            totals[judgement] += c
+    observed = agreement / len(items)
+    expected = sum((c / num_ratings) ** 2 for c in totals.values())
+    return (observed - expected) / (1 - expected) if expected < 1 else 1.0
+
+
+def krippendorff_alpha(items):
+    """Krippendorff's alpha for nominal data, computed from the coincidence
+    matrix of a list of items, each a dict of judgement => number of
+    raters."""
+    coincidences = defaultdict(float) # (judgement, judgement) => weight
+    for counts in items:
+        m = sum(counts.values())
+        if m < 2:
+            continue
+        for c, n_c in counts.items():
+            for k, n_k in counts.items():
+                coincidences[(c, k)] += n_c * (n_k - (c == k)) / (m - 1)
+    marginals = defaultdict(float)
+    for (c, _), weight in coincidences.items():
+        marginals[c] += weight
+    n = sum(marginals.values())
+    if n < 2:
+        return None
+    disagreement_observed = sum(w for (c, k), w in coincidences.items() if c != k)
+    disagreement_expected = sum(marginals[c] * marginals[k]
+                                for c in marginals for k in marginals if c != k)
+    if disagreement_expected == 0:
+        return 1.0
+    return 1 - (n - 1) * disagreement_observed / disagreement_expected
+
+
+def cohen_kappa(table):
+    """Cohen's kappa for a contingency table, given as a dict of
+    (judgement_1, judgement_2) => count."""
+    n = sum(table.values())
+    rows, columns = defaultdict(int), defaultdict(int)
+    for (j1, j2), count in table.items():
+        rows[j1] += count
+        columns[j2] += count
+    observed = sum(count for (j1, j2), count in table.items() if j1 == j2) / n
+    expected = sum(rows[j] * columns[j] for j in rows) / n ** 2
+    return (observed - expected) / (1 - expected) if expected < 1 else 1.0
+
+
+def agreement(index):
+    """Yields rows of (measure, rating, level, rater_1, rater_2, n, value)."""
+    items = defaultdict(lambda: defaultdict(dict)) # (condition_st, level) => item => judgement => count
+    for condition_st, file_id, file_order, judgement, count in index.judgement_counts():
+        items[(condition_st, file_id[-1])][(file_id, file_order)][judgement] = count
+    for (condition_st, level), group in sorted(items.items()):
+        counts = list(group.values())
+        yield ('fleiss_kappa', FIELDNAME[condition_st], LEVELS[level], '', '',
+               len(counts), fleiss_kappa(counts))
+        yield ('krippendorff_alpha', FIELDNAME[condition_st], LEVELS[level], '', '',
+               len(counts), krippendorff_alpha(counts))
+    tables = defaultdict(dict) # (condition_st, level, rater_1, rater_2) => contingency table
+    for condition_st, level, rater1, rater2, j1, j2, count in index.pair_counts():
+        tables[(condition_st, level, rater1, rater2)][(j1, j2)] = count
+    for (condition_st, level, rater1, rater2), table in sorted(tables.items()):
+        yield ('cohen_kappa', FIELDNAME[condition_st], LEVELS[level], rater1, rater2,
+               sum(table.values()), cohen_kappa(table))
+
+
+def spam_catch_rates(index, items):
+    """Yields rows of (measure, rating, level, rater, '', n, value): the share
+    of spam items for which a rater did not choose the spam option."""
+    caught = defaultdict(lambda: [0, 0]) # (condition_st, level, rater) => [caught, total]
+    for file_id, file_order, condition_st, rater, judgement in index.ratings():
+        _, A_origin, B_origin = items[(file_id, file_order)]
+        if 'spam' not in (A_origin, B_origin):
+            continue
+        origin = {'A': A_origin, 'B': B_origin}.get(judgement, 'tie')
+        counts = caught[(condition_st, file_id[-1], rater)]
+        counts[0] += origin != 'spam'
+        counts[1] += 1
+    for (condition_st, level, rater), (num_caught, total) in sorted(caught.items()):
+        yield ('spam_caught', FIELDNAME[condition_st], LEVELS[level], rater, '',
+               total, num_caught / total)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Computes inter-rater agreement and spam catch rates.')
+    parser.add_argument('--items', required=False, default='items.csv',
+                        help='The original items (CSV or SQLite).')
+    parser.add_argument('--sents', type=str, required=False, default='results/sentences/',
+                        help='Folder containing stentence-level results.')
+    parser.add_argument('--docs', type=str, required=False, default='results/documents/',
+                        help='Folder containing document-level results.')
+    parser.add_argument('--index', type=str, required=False, default='ratings.sqlite',
+                        help='The ratings index, created if it does not exist. Use '
+                             ':memory: to read all ratings from scratch.')
+    args = parser.parse_args()
+
+    items = read_items(args.items)
+    index = RatingsIndex(args.index)
+    try:
+        index.update(find_ratings(args.sents, args.docs))
+    except ValueError as e:
+        parser.error(str(e))
+    index.exclude([key for key, (_, A_origin, B_origin) in items.items()
+                   if 'spam' in (A_origin, B_origin)])
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['measure', 'rating', 'level', 'rater_1', 'rater_2', 'n', 'value'])
+    for row in agreement(index):
+        writer.writerow(row[:-1] + ('' if row[-1] is None else '{0:.4f}'.format(row[-1]),))
+    for row in spam_catch_rates(index, items):
+        writer.writerow(row[:-1] + ('{0:.4f}'.format(row[-1]),))
+    index.close()
@@ -0,0 +1,147 @@
+"""Aligns document-level translations, such as the spreadsheet by Graham
+Neubig (`graham-ht.csv`), with the sentences of a sentence-aligned testset.
+
+An article of the testset is aligned with the document of the same order
+number by position, if both have the same number of sentences. Source
+sentences of all documents are hashed once (after normalisation), to find
+documents without an order number, and to align sentence by sentence if the
+numbers differ. If a document's source and translation have different
+numbers of sentences, they are realigned based on sentence lengths (Gale and
+Church, 1993) instead of being skipped.
+"""
+
+import csv
+import math
+import logging
+import unicodedata
+from collections import Counter
+
+
+# (source sentences, target sentences) per bead, and the penalty for using it
+BEADS = {
+    (1, 1): 0.0,
+    (1, 0): 4.5,
+    (0, 1): 4.5,
+    (2, 1): 2.3,
+    (1, 2): 2.3,
+}
+
+
+def normalise_source(sentence):
+    """Normalises a source sentence for lookup: Unicode NFKC (e.g., full-width
+    punctuation) and no whitespace."""
+    return ''.join(unicodedata.normalize('NFKC', sentence).split())
+
+
+def length_cost(len_src, len_trg, ratio):
+    """Cost of aligning `len_src` source to `len_trg` target characters."""
+    expected = len_src * ratio
+    return abs(len_trg - expected) / math.sqrt(expected + len_trg + 1)
+
+
+def realign(sentences_src, sentences_trg):
+    """Aligns two lists of sentences of different lengths. Returns a list of
+    translations, one per source sentence. If several source sentences are
+    translated by one target sentence, the target sentence is assigned to the
+    first of them; the others are left empty."""
+    n, m = len(sentences_src), len(sentences_trg)
+    len_src = [len(s) for s in sentences_src]
+    len_trg = [len(s) for s in sentences_trg]
+    ratio = (sum(len_trg) + 1) / (sum(len_src) + 1)
+    # dynamic programming over beads
+    cost = [[math.inf] * (m + 1) for _ in range(n + 1)]
+    back = [[None] * (m + 1) for _ in range(n + 1)]
+    cost[0][0] = 0.0
+    for i in range(n + 1):
+        for j in range(m + 1):
+            if cost[i][j] == math.inf:
+                continue
+            for (di, dj), penalty in BEADS.items():
+                if i + di > n or j + dj > m:
+                    continue
+                c = cost[i][j] + penalty + length_cost(
+                    sum(len_src[i:i+di]), sum(len_trg[j:j+dj]), ratio)
+                if c < cost[i+di][j+dj]:
+                    cost[i+di][j+dj] = c
+                    back[i+di][j+dj] = (di, dj)
+    # follow back pointers
+    beads = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        di, dj = back[i][j]
+        i, j = i - di, j - dj
+        beads.append((i, di, j, dj))
+    translations = [''] * n
+    dangling = [] # target sentences without a source sentence
+    for i, di, j, dj in reversed(beads):
+        if di == 0:
+            dangling.extend(sentences_trg[j:j+dj])
+            continue
+        translations[i] = ' '.join(dangling + sentences_trg[j:j+dj])
+        dangling = []
+    if dangling: # attach to the last translated sentence
+        last = max(i for i, t in enumerate(translations) if t) if any(translations) else n - 1
+        translations[last] = ' '.join([translations[last]] + dangling).strip()
+    return translations
+
+
+class DocumentAligner:
+    """Maps source sentences of a testset to document-level translations."""
+
+    def __init__(self, name='human_b'):
+        self.name = name
+        self.documents = {} # order => (normalised source sentences, translations)
+        self.index = {} # normalised source sentence => order
+
+    def add(self, order, sentences_src, sentences_trg):
+        if len(sentences_src) != len(sentences_trg):
+            logging.warning('Realigning item %s in %s. Original contains %s sentences, Translation contains %s.',
+                            order, self.name, len(sentences_src), len(sentences_trg))
+            translations = realign(sentences_src, sentences_trg)
+        else:
+            translations = sentences_trg
+        keys = [normalise_source(s) for s in sentences_src]
+        for key in keys:
+            self.index.setdefault(key, order)
+        self.documents[order] = keys, list(translations)
+
+    def align(self, order, sentences):
+        """Returns the translation of each sentence in an article, or an empty
+        string where none is available. The article is identified by `order`
+        if that is known, and by a lookup of its sentences otherwise. If it has
+        as many sentences as the document, they are aligned by position."""
+        keys = [normalise_source(s) for s in sentences]
+        if order not in self.documents:
+            votes = Counter(self.index[k] for k in keys if k in self.index)
+            if not votes:
+                return [''] * len(sentences)
+            order = votes.most_common(1)[0][0]
+        document_keys, document_translations = self.documents[order]
+        if len(keys) == len(document_keys):
+            mismatches = sum(1 for k, d in zip(keys, document_keys) if k != d)
+            if mismatches:
+                logging.warning('%s of %s sentences of item %s differ from the source in %s.',
+                                mismatches, len(keys), order, self.name)
+            return list(document_translations)
+        document = dict(zip(document_keys, document_translations))
+        translations = [document.get(k, '') for k in keys]
+        missing = sum(1 for k in keys if k not in document)
+        if missing and missing < len(keys):
+            logging.warning('%s of %s sentences of item %s not found in %s.',
+                            missing, len(keys), order, self.name)
+        return translations
+
+
+def read_spreadsheet(filepath, name='human_b'):
+    """Reads a spreadsheet with one document per row, in the format of
+    `graham-ht.csv`. Sentences are separated by line breaks."""
+    aligner = DocumentAligner(name)
+    with open(filepath, encoding='utf-8-sig') as f: # utf-8-sig since Excel writes BOM
+        for article in csv.DictReader(f):
+            sentences_src = [s for s in article['Original'].split('\n') if s.strip() != '']
+            sentences_trg = [s for s in article['Translation (English)'].split('\n') if s.strip() != '']
+            if not sentences_src or not sentences_trg:
+                continue
+            order = int(article['Order']) if article['Order'] else ('row', len(aligner.documents))
+            aligner.add(order, sentences_src, sentences_trg)
+    return aligner
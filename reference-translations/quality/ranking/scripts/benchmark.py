@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+"""Times `combine_data`, `create_experiment`, `create_html` and
+`combine_results` on synthetic data of any size.
+
+For each scale, a testset, two sentence-aligned translations, a document
+spreadsheet in the format of `graham-ht.csv` and rater spreadsheets are
+generated from `--seed`. Scale 1 is about the size of the real testset (169
+articles, 123 of them originally written in Chinese); at scale N, there are N
+times as many articles, and N times as many documents and sentences are
+sampled per rater.
+
+The fastest of `--repeat` runs is reported for each stage. With
+`--save-baseline FILE`, the report is stored; with `--baseline FILE`, the
+script fails if any stage is more than `--tolerance` slower than stored.
+Timings depend on the machine, so baselines should not be shared.
+"""
+
+import os
+import sys
+import csv
+import json
+import random
+import logging
+from argparse import ArgumentParser
+
+from tables import read_table, TableWriter
+from combine_data import combine, fieldnames
+from create_experiment import create_experiment, SEED
+from create_html import create_html
+from design import Design, SAMPLING
+from instrumentation import Instrumentation
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from combine_results import combine_results
+
+
+NOISE = 0.02 # seconds; differences below this are never regressions
+
+# articles per scale, share originally written in Chinese, and share of
+# these with a document translation, roughly as in the real testset
+ARTICLES = 169
+SHARE_ZH = 0.73
+SHARE_DOCUMENT = 0.6
+SENTENCES = (4, 16) # per article
+HANZI = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+WORDS = ('the a of to and in that is for on with as was by at from it he said '
+         'would has have China Chinese government city year market people new '
+         'percent company development said" "the - report').split()
+
+
+def hanzi_sentence(rng):
+    return ''.join(rng.choices(HANZI, k=rng.randint(15, 60))) + '。'
+
+
+def english_sentence(rng):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(8, 35))).capitalize() + '.'
+
+
+def generate(directory, scale, seed):
+    """Writes a synthetic testset (`src.sgm`), translations (`mt.txt`,
+    `human_a.txt`, `human_b.csv`) to `directory`. Returns the systems as
+    (name, path)."""
+    rng = random.Random('{0}-{1}'.format(seed, scale))
+    paths = {name: os.path.join(directory, name) for name in
+             ('src.sgm', 'mt.txt', 'human_a.txt', 'human_b.csv')}
+    with open(paths['src.sgm'], 'w') as f_src, \
+         open(paths['mt.txt'], 'w') as f_mt, \
+         open(paths['human_a.txt'], 'w') as f_human_a, \
+         open(paths['human_b.csv'], 'w', newline='', encoding='utf-8-sig') as f_human_b:
+        f_src.write('<srcset setid="synthetic" srclang="any">\n')
+        spreadsheet = csv.writer(f_human_b)
+        spreadsheet.writerow(['Order', 'Original', '文字数', 'Translation (English)'])
+        for order in range(ARTICLES * scale):
+            origlang = 'zh' if rng.random() < SHARE_ZH else 'en'
+            sentences = [hanzi_sentence(rng) for _ in range(rng.randint(*SENTENCES))]
+            f_src.write('<doc sysid="ref" docid="synthetic.{0}" genre="news" origlang="{1}">\n'
+                        '<p>\n'.format(order, origlang))
+            for i, sentence in enumerate(sentences, start=1):
+                f_src.write('<seg id="{0}">{1}</seg>\n'.format(i, sentence))
+                f_mt.write(english_sentence(rng) + '\n')
+                f_human_a.write(english_sentence(rng) + '\n')
+            f_src.write('</p>\n</doc>\n')
+            if origlang == 'zh' and rng.random() < SHARE_DOCUMENT:
+                translations = [english_sentence(rng) for _ in sentences]
+                if len(translations) > 2 and rng.random() < 0.3: # a 2-1 alignment
+                    translations[0:2] = [' '.join(translations[0:2])]
+                spreadsheet.writerow([order, '\n'.join(sentences), sum(map(len, sentences)),
+                                      ' \n'.join(translations)])
+        f_src.write('</srcset>\n')
+    return paths['src.sgm'], [('mt', paths['mt.txt']), ('human_a', paths['human_a.txt']),
+                              ('human_b', paths['human_b.csv'])]
+
+
+def generate_ratings(directory, items, raters, seed):
+    """Writes one spreadsheet per rater and level, with `raters` raters for
+    each file and variant (monolingual, bilingual). Returns their paths."""
+    rng = random.Random(seed)
+    files = {}
+    for item in items:
+        files.setdefault(item['file_id'], []).append(item)
+    paths = []
+    for file_id, file_items in sorted(files.items()):
+        level = 'sentences' if file_id.endswith('s') else 'documents'
+        os.makedirs(os.path.join(directory, level), exist_ok=True)
+        for variant in 'mb':
+            for rater in range(raters):
+                path = os.path.join(directory, level, '{0}{1}-{2}.csv'.format(variant, file_id, rater))
+                with open(path, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['ID', 'Judgement'])
+                    for item in file_items:
+                        if item['A_origin'] == 'spam':
+                            judgement = 'B' if rng.random() < 0.9 else 'A'
+                        elif item['B_origin'] == 'spam':
+                            judgement = 'A' if rng.random() < 0.9 else 'B'
+                        else:
+                            judgement = rng.choice('ABX')
+                        writer.writerow(['{0}{1}-{2}'.format(variant, file_id, item['file_order']),
+                                         judgement])
+                paths.append(path)
+    return paths
+
+
+def run(directory, src, systems, scale, seed, sampling, raters, instruments):
+    """Runs all stages once on the data generated in `directory`."""
+    data_path = os.path.join(directory, 'data.csv')
+    with instruments.stage('combine_data') as stage:
+        with TableWriter(data_path, fieldnames(systems)) as writer:
+            for row in combine(src, systems):
+                writer.writerow(row)
+                stage.rows += 1
+        stage.bytes_written = writer.bytes_written
+    rows = list(read_table(data_path))
+
+    design = Design(documents=50 * scale, sentences=104 * scale)
+    with instruments.stage('create_experiment') as stage:
+        items = [item.as_row() for item in create_experiment(rows, design, sampling, seed)]
+        stage.rows = len(items)
+
+    html = os.path.join(directory, 'html')
+    os.makedirs(html, exist_ok=True)
+    with instruments.stage('create_html') as stage:
+        written = create_html(items, html)
+        stage.rows = len(items)
+        stage.bytes_written = sum(size for _, size in written)
+
+    ratings = generate_ratings(os.path.join(directory, 'ratings'), items, raters, seed)
+    with instruments.stage('combine_results') as stage:
+        _, results = combine_results(items, ratings)
+        stage.rows = len(results)
+
+
+def benchmark(directory, scales, seed=SEED, sampling='single-pass', raters=2, repeat=3):
+    """Returns the fastest run of each stage per scale, as a dict of
+    '{scale}/{stage}' => stage report (see `instrumentation.py`)."""
+    report = {}
+    for scale in scales:
+        scale_directory = os.path.join(directory, 'scale-{0}'.format(scale))
+        os.makedirs(scale_directory, exist_ok=True)
+        src, systems = generate(scale_directory, scale, seed)
+        for _ in range(repeat):
+            instruments = Instrumentation(__file__)
+            run(scale_directory, src, systems, scale, seed, sampling, raters, instruments)
+            for stage in instruments.stages:
+                key = '{0}/{1}'.format(scale, stage.name)
+                if key not in report or stage.wall_time < report[key]['wall_time']:
+                    report[key] = stage.as_dict()
+    return report
+
+
+def regressions(report, baseline, tolerance):
+    """Yields a message for each stage in `report` that is slower than in
+    `baseline` by more than `tolerance` (e.g., 0.25 for 25%)."""
+    for key, stage in report.items():
+        if key not in baseline:
+            continue
+        before, after = baseline[key]['wall_time'], stage['wall_time']
+        if after > before * (1 + tolerance) + NOISE:
+            yield '{0}: {1:.3f}s, baseline {2:.3f}s ({3:+.0%})'.format(
+                key, after, before, after / before - 1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR) # synthetic data is realigned often
+
+    parser = ArgumentParser(description='Benchmarks the ranking pipeline on synthetic data.')
+    parser.add_argument('-s', '--scale', type=int, nargs='+', default=[1, 10],
+                        help='Sizes relative to the real testset (default: 1 10).')
+    parser.add_argument('-d', '--directory', default='benchmark',
+                        help='Where synthetic data is written (default: benchmark).')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='Random seed for data and sampling (default: {0}).'.format(SEED))
+    parser.add_argument('--sampling', choices=sorted(SAMPLING), default='single-pass',
+                        help='How documents and sentences are sampled (default: single-pass).')
+    parser.add_argument('--raters', type=int, default=2,
+                        help='Number of raters per file and variant (default: 2).')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of runs per scale; the fastest is reported (default: 3).')
+    parser.add_argument('--baseline', help='Fail if any stage is slower than in this report.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Slowdown allowed relative to the baseline (default: 0.25).')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='Write the report to FILE for later use with --baseline.')
+    args = parser.parse_args()
+
+    report = benchmark(args.directory, args.scale, args.seed, args.sampling,
+                       args.raters, args.repeat)
+
+    print('{0:<24}{1:>10}{2:>10}{3:>14}{4:>12}'.format(
+        'stage', 'rows', 'seconds', 'rows/sec', 'peak MB'))
+    for key, stage in report.items():
+        print('{0:<24}{1:>10}{2:>10.3f}{3:>14}{4:>12.1f}'.format(
+            key, stage['rows'], stage['wall_time'], stage['rows_per_sec'],
+            (stage['peak_rss'] or 0) / 2**20))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = list(regressions(report, baseline, args.tolerance))
+        if slower:
+            parser.exit(1, 'PERFORMANCE REGRESSION\n' + '\n'.join(slower) + '\n')
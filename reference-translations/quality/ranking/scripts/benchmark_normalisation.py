@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Compares the time needed to normalise a sentence-aligned translation file
+with chained `str.replace` calls for every rule (as `combine_data.py` used to
+do) and with the compiled rules in `normalisation.py`."""
+
+import timeit
+import unicodedata
+from argparse import ArgumentParser
+
+from normalisation import Normaliser, RULES, NFKC, DEFAULT_RULES
+
+
+parser = ArgumentParser(description='Benchmarks segment normalisation.')
+parser.add_argument('input', nargs='?', default='input/microsoft-ht.txt',
+                    help='A sentence-aligned text file (default: input/microsoft-ht.txt).')
+parser.add_argument('--rule', action='append', choices=sorted(RULES) + [NFKC],
+                    help='Normalisation rule. Can be repeated. Defaults to quotes.')
+parser.add_argument('-s', '--scale', type=int, default=100,
+                    help='Number of times the input is repeated (default: 100).')
+parser.add_argument('-c', '--chunk', type=int, default=20,
+                    help='Number of segments normalised at once, i.e., the '
+                         'typical number of sentences per article (default: 20).')
+parser.add_argument('-r', '--repeat', type=int, default=3,
+                    help='Number of runs per method; the fastest is reported (default: 3).')
+args = parser.parse_args()
+
+with open(args.input) as f:
+    segments = f.readlines() * args.scale
+chunks = [segments[i:i+args.chunk] for i in range(0, len(segments), args.chunk)]
+
+normalise = Normaliser(args.rule or DEFAULT_RULES)
+pairs = list(normalise.mapping.items())
+
+def normalise_chained(segment):
+    if normalise.nfkc:
+        segment = unicodedata.normalize('NFKC', segment)
+    for char, replacement in pairs:
+        segment = segment.replace(char, replacement)
+    return segment.strip()
+
+methods = [
+    ('chained str.replace', lambda: [normalise_chained(s) for s in segments]),
+    ('compiled, per segment', lambda: [normalise(s) for s in segments]),
+    ('compiled, per chunk', lambda: [s for c in chunks for s in normalise.normalise_all(c)]),
+]
+expected = methods[0][1]()
+for _, method in methods[1:]:
+    assert method() == expected
+
+print('{0} segments, {1} replacements{2}'.format(
+    len(segments), len(pairs), ' + NFKC' if normalise.nfkc else ''))
+baseline = None
+for name, method in methods:
+    seconds = min(timeit.repeat(method, number=1, repeat=args.repeat))
+    baseline = baseline or seconds
+    print('{0:<24}{1:8.3f}s{2:8.2f}x'.format(name, seconds, baseline / seconds))
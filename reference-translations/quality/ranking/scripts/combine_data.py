@@ -1,97 +1,209 @@
 #!/usr/bin/env python3
 
+import io
+import os
 import re
-import csv
-import sys
 import logging
-from argparse import ArgumentParser, FileType
-
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
-
-def normalise(segment):
-    return segment.replace('“', '"') \
-                  .replace('”', '"') \
-                  .replace('‘', "'") \
-                  .replace('’', "'") \
-                  .strip()
-
-parser = ArgumentParser(description='Combines WMT18 ZH-EN articles with '
-                                    'translations from Microsoft (Hassan et '
-                                    'al., 2018) and Graham Neubig.')
-parser.add_argument('src', help='The WMT18 ZH-EN testset (newstest2017-zhen-src.zh.sgm).')
-parser.add_argument('trg_mt', help='The machine translations produced by Microsoft (microsoft-mt-combo6.txt).') # https://github.com/MicrosoftTranslator/Translator-HumanParityData/blob/master/Translator-HumanParityData/Translations/Translator-HumanParityData-Combo-6.txt
-parser.add_argument('trg_human_a', help='The human translations collected by microsoft (microsoft-ht.txt).')
-# https://github.com/MicrosoftTranslator/Translator-HumanParityData/blob/master/Translator-HumanParityData/References/Translator-HumanParityData-Reference-HT.txt
-parser.add_argument('trg_human_b', help='The human translations collected by Graham Neugbig  (graham-ht.csv). Caution: Line breaks are encoded as \\r.')
-parser.add_argument('-0', '--output', type=FileType('w'), default=sys.stdout,
-                    help='Output file (CSV). Defaults to stdout.')
-
-args = parser.parse_args()
+from itertools import islice
+from argparse import ArgumentParser
+
+from tables import TableWriter
+from aligner import read_spreadsheet
+from normalisation import Normaliser, RULES, NFKC, DEFAULT_RULES
+import instrumentation
 
 # define regexes to find article ids (ugly)
 article_id = re.compile(r'docid="([^"]+)"')
 article_origlang = re.compile(r'origlang="([^"]+)"')
 segment_content = re.compile(r'<seg[^>]+>(.*)</seg>')
 
-# collect all article ids and sentence counts from sgm
-lines = []
-article_count = 0
-with open(args.src) as f:
-    for line_number, line in enumerate(f):
-        try:
-            wmt_id = article_id.search(line).groups()[0]
-            wmt_order = article_count
-            article_count += 1 # Graham's order numbers start at 0
+def read_articles(sgm_file, article_count=0):
+    """Yields one article at a time from an SGML testset, as a tuple of
+    (wmt_order, wmt_id, origlang, sentences). Only the current article is
+    kept in memory. If the file does not start at the first article,
+    `article_count` is the position of the next one."""
+    article = None
+    for line in sgm_file:
+        match = article_id.search(line)
+        if match:
+            if article is not None:
+                yield article
             origlang = article_origlang.search(line).groups()[0]
-        except AttributeError:
-            pass
-        if line.startswith('<seg'):
-            sentence = segment_content.search(line).groups()[0]
-            lines.append({
-                'origlang': origlang,
-                'wmt_id': wmt_id,
-                'wmt_order': wmt_order,
-                'src': sentence
-            })
-
-# collect human_a, mt (Microsoft)
-for origin, filepath in {'human_a': args.trg_human_a, 'mt': args.trg_mt}.items():
-    with open(filepath) as f:
-        for line_number, sentence in enumerate(f):
-            lines[line_number][origin] = normalise(sentence)
-
-# calculate line numbers where articles begin to mix in human_b
-wo = [line['wmt_order'] for line in lines]
-offsets = {b: i for i, (a, b) in enumerate(zip([None] + wo, wo)) if a != b}
-
-# collect human_b (Graham Neubig)
-with open(args.trg_human_b, encoding='utf-8-sig') as f: # utf-8-sig since Excel writes BOM
-    csv_reader = csv.DictReader(f)
-    for article in csv_reader:
-        wmt_order = article['Order']
-        if wmt_order:
-            sentences_src = [s for s in article['Original'].split('\n') if s != '']
-            sentences_trg = [s for s in article['Translation (English)'].split('\n') if s != '']
-            if len(sentences_src) == len(sentences_trg):
-                line_number = offsets[int(wmt_order)]
-                for sentence_src, sentence_trg in zip(sentences_src, sentences_trg):
-                    assert lines[line_number]['src'] == sentence_src # just to be sure...
-                    lines[line_number]['human_b'] = sentence_trg
-                    line_number += 1
-            else:
-                logging.warning('Skipping item %s in human_b. Original contains %s sentences, Translation contains %s.', wmt_order, len(sentences_src), len(sentences_trg))
-
-# write csv
-writer = csv.DictWriter(args.output, fieldnames=['wmt_article', 'wmt_line', 'wmt_article_name', 'src', 'mt', 'human_a', 'human_b'])
-writer.writeheader()
-for line_number, line in enumerate(lines):
-    if line['origlang'] == 'zh': # only keep articles who were originally written in Chinese
-        writer.writerow({
-            'wmt_article': line['wmt_order'],
-            'wmt_line': line_number + 1,
-            'wmt_article_name': line['wmt_id'],
-            'src': line['src'],
-            'mt': line['mt'],
-            'human_a': line['human_a'],
-            'human_b': line['human_b'] if 'human_b' in line else ''
-        })
+            article = (article_count, match.groups()[0], origlang, [])
+            article_count += 1 # Graham's order numbers start at 0
+        elif line.startswith('<seg'):
+            article[3].append(segment_content.search(line).groups()[0])
+        elif line.startswith('</doc') and article is not None:
+            yield article
+            article = None
+    if article is not None:
+        yield article
+
+def read_translations(trg_file, num_sentences, normalise):
+    """Reads and normalises the next `num_sentences` lines from a
+    sentence-aligned translation file."""
+    sentences = normalise.normalise_all(list(islice(trg_file, num_sentences)))
+    assert len(sentences) == num_sentences, "Translation file %s ends prematurely." % trg_file.name
+    return sentences
+
+def skip_translations(trg_file, num_sentences):
+    """Skips the next `num_sentences` lines of a sentence-aligned translation
+    file."""
+    skipped = sum(1 for _ in islice(trg_file, num_sentences))
+    assert skipped == num_sentences, "Translation file %s ends prematurely." % trg_file.name
+
+def system(value):
+    """Parses a `name=path` argument."""
+    name, sep, path = value.partition('=')
+    if not sep or not name or not path:
+        raise ValueError(value)
+    return name, path
+
+def fieldnames(systems):
+    return ['wmt_article', 'wmt_line', 'wmt_article_name', 'src'] + [name for name, _ in systems]
+
+def lines(path):
+    """Yields the byte offset of each line of a file, with lines split as
+    in text mode."""
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            for part in line.splitlines(keepends=True): # also splits at \r
+                yield offset
+                offset += len(part)
+
+def index_articles(src, systems):
+    """Returns where each article of testset `src` starts, as a list of
+    (byte offset in `src`, number of sentences before it, dict of name =>
+    byte offset in each sentence-aligned translation of `systems`), so that
+    `combine` can start reading at any article."""
+    src_offsets, first_sentences = [], []
+    num_sentences = 0
+    with open_at(src) as f_src:
+        for offset, line in zip(lines(src), f_src):
+            if article_id.search(line):
+                src_offsets.append(offset)
+                first_sentences.append(num_sentences)
+            elif line.startswith('<seg'):
+                num_sentences += 1
+    translations = {}
+    for name, path in systems:
+        if not path.endswith('.csv'):
+            offsets = list(lines(path)) + [os.path.getsize(path)] # a short file ends early
+            translations[name] = [offsets[min(first, len(offsets) - 1)] for first in first_sentences]
+    return [(offset, first, {name: offsets[i] for name, offsets in translations.items()})
+            for i, (offset, first) in enumerate(zip(src_offsets, first_sentences))]
+
+def open_at(path, offset=0):
+    """Opens a text file for reading at byte `offset`."""
+    f = open(path, 'rb')
+    f.seek(offset)
+    return io.TextIOWrapper(f)
+
+def combine(src, systems, normalise=DEFAULT_RULES, origlang='zh', articles=None, aligners=None,
+            start=None):
+    """Yields one row per sentence of all articles originally written in
+    `origlang` (any language if None) in testset `src`, with translations by
+    all `systems`, a list of (name, path). The testset and all translations
+    are read in lockstep, one article at a time. All values are strings, as if
+    read from CSV.
+
+    If `articles` is given (a range), only articles at these positions in
+    the testset are combined, and reading stops after the last one. If
+    `start` is the entry of `index_articles` for `articles.start`, reading
+    starts at that article instead of at the beginning of each file.
+    Document-level translations that have already been read can be passed
+    as `aligners`, a dict of name => `DocumentAligner`."""
+    names = [name for name, _ in systems]
+    if len(set(names)) != len(names):
+        raise ValueError('System names must be unique: ' + ', '.join(names))
+    normalise = Normaliser(normalise)
+    # collect document-level translations (e.g., Graham Neubig)
+    aligners = aligners or {}
+    document_systems = {name: aligners[name] if name in aligners else read_spreadsheet(path, name)
+                        for name, path in systems if path.endswith('.csv')}
+    if start is None:
+        src_offset, line_number, offsets, first_article = 0, 0, {}, 0
+    else:
+        (src_offset, line_number, offsets), first_article = start, articles.start
+    sentence_files = {}
+    try:
+        for name, path in systems:
+            if name not in document_systems:
+                sentence_files[name] = open_at(path, offsets.get(name, 0))
+        with open_at(src, src_offset) as f_src:
+            for wmt_order, wmt_id, article_origlang, sentences in read_articles(f_src, first_article):
+                if articles is not None and wmt_order >= articles.stop:
+                    break
+                # only keep articles originally written in `origlang`
+                if (origlang is not None and article_origlang != origlang) or \
+                   (articles is not None and wmt_order not in articles):
+                    for f in sentence_files.values():
+                        skip_translations(f, len(sentences))
+                else:
+                    translations = {}
+                    for name, f in sentence_files.items():
+                        translations[name] = read_translations(f, len(sentences), normalise)
+                    for name, aligner in document_systems.items():
+                        translations[name] = aligner.align(wmt_order, sentences)
+                    for i, sentence in enumerate(sentences):
+                        row = {
+                            'wmt_article': str(wmt_order),
+                            'wmt_line': str(line_number + i + 1),
+                            'wmt_article_name': wmt_id,
+                            'src': sentence,
+                        }
+                        for name in names:
+                            row[name] = translations[name][i]
+                        yield row
+                line_number += len(sentences)
+    finally:
+        for f in sentence_files.values():
+            f.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = ArgumentParser(description='Combines WMT18 ZH-EN articles with '
+                                        'translations from Microsoft (Hassan et '
+                                        'al., 2018) and Graham Neubig.')
+    parser.add_argument('src', help='The WMT18 ZH-EN testset (newstest2017-zhen-src.zh.sgm).')
+    parser.add_argument('trg_mt', nargs='?', help='The machine translations produced by Microsoft (microsoft-mt-combo6.txt).') # https://github.com/MicrosoftTranslator/Translator-HumanParityData/blob/master/Translator-HumanParityData/Translations/Translator-HumanParityData-Combo-6.txt
+    parser.add_argument('trg_human_a', nargs='?', help='The human translations collected by microsoft (microsoft-ht.txt).')
+    # https://github.com/MicrosoftTranslator/Translator-HumanParityData/blob/master/Translator-HumanParityData/References/Translator-HumanParityData-Reference-HT.txt
+    parser.add_argument('trg_human_b', nargs='?', help='The human translations collected by Graham Neugbig  (graham-ht.csv). Caution: Line breaks are encoded as \\r.')
+    parser.add_argument('--system', type=system, action='append', default=[], metavar='NAME=PATH',
+                        help='Additional translations, stored in column NAME. PATH is either a '
+                             'sentence-aligned text file or, if it ends in .csv, a document-level '
+                             'spreadsheet in the format of graham-ht.csv. Can be repeated.')
+    parser.add_argument('--normalise', action='append', choices=sorted(RULES) + [NFKC], metavar='RULE',
+                        help='Normalisation rule for sentence-aligned translations, one of %(choices)s. '
+                             'Can be repeated. Defaults to quotes.')
+    parser.add_argument('--origlang', default='zh',
+                        help='Only keep articles originally written in this language, or in any '
+                             'language if `any` (default: zh).')
+    parser.add_argument('-0', '--output', default='-',
+                        help='Output file (CSV, or SQLite if it ends in .sqlite). Defaults to stdout.')
+    instrumentation.add_arguments(parser)
+
+    args = parser.parse_args()
+    instruments = instrumentation.from_arguments(__file__, args)
+
+    systems = [(name, path) for name, path in [
+        ('mt', args.trg_mt),
+        ('human_a', args.trg_human_a),
+        ('human_b', args.trg_human_b),
+    ] if path] + args.system
+    names = [name for name, _ in systems]
+    if len(set(names)) != len(names):
+        parser.error('System names must be unique: ' + ', '.join(names))
+
+    # write each article as soon as it is complete
+    with instruments.stage('combine') as stage:
+        with TableWriter(args.output, fieldnames(systems)) as writer:
+            for row in combine(args.src, systems, args.normalise or DEFAULT_RULES,
+                               None if args.origlang == 'any' else args.origlang):
+                writer.writerow(row)
+                stage.rows += 1
+        stage.bytes_written = writer.bytes_written
+    instruments.close(args.metrics)
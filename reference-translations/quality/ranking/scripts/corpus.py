@@ -0,0 +1,117 @@
+"""In-memory storage of the output of `combine_data.py`.
+
+All sentences of a column (`src`, `mt`, ...) are stored in one string, joined
+by single spaces in article order, together with the offsets at which each
+sentence starts and ends. Sentences and whole articles are views on these
+buffers: since sentences are joined by spaces, the text of an article is a
+single slice, which is only taken when it is accessed. Empty sentences (e.g.,
+where a translation spans two source sentences) are left out of the text of
+an article.
+"""
+
+import re
+from array import array
+from bisect import bisect_left
+
+
+META = ('wmt_article', 'wmt_line', 'wmt_article_name')
+
+token = re.compile(r'\S+') # same as str.split()
+
+
+class Corpus:
+
+    def __init__(self, articles):
+        """Creates a corpus from a dict of article id => list of sentences
+        (rows of `combine_data.py` output)."""
+        rows = [row for sentences in articles.values() for row in sentences]
+        self.columns = [c for c in (rows[0] if rows else {}) if c not in META]
+        self.meta = [tuple(row[m] for m in META) for row in rows]
+        self.buffers = {}
+        self.starts = {}
+        self.ends = {}
+        self.empty = {} # column => indexes of empty sentences, ascending
+        for column in self.columns:
+            starts, ends = array('q'), array('q')
+            self.empty[column] = array('q', (i for i, row in enumerate(rows) if not row[column]))
+            offset = 0
+            for row in rows:
+                starts.append(offset)
+                offset += len(row[column])
+                ends.append(offset)
+                offset += 1 # space
+            self.buffers[column] = ' '.join(row[column] for row in rows)
+            self.starts[column] = starts
+            self.ends[column] = ends
+        self.articles = {} # article id => list of sentence views
+        first = 0
+        for article_id, sentences in articles.items():
+            self.articles[article_id] = [View(self, i, i) for i in range(first, first + len(sentences))]
+            first += len(sentences)
+
+    def document(self, article_id):
+        """Returns a view on all sentences of an article."""
+        sentences = self.articles[article_id]
+        return View(self, sentences[0].first, sentences[-1].last, merged=True)
+
+
+class View:
+    """A sentence, or a range of sentences merged into one document. Can be
+    accessed like a row of `combine_data.py` output."""
+
+    __slots__ = ('corpus', 'first', 'last', 'merged')
+
+    def __init__(self, corpus, first, last, merged=False):
+        self.corpus = corpus
+        self.first = first
+        self.last = last
+        self.merged = merged
+
+    def __len__(self):
+        return self.last - self.first + 1
+
+    def __contains__(self, key):
+        return key in META or key in self.corpus.buffers
+
+    def __getitem__(self, key):
+        if key in self.corpus.buffers:
+            empty = self.corpus.empty[key]
+            if self.merged and bisect_left(empty, self.first) < bisect_left(empty, self.last + 1):
+                sentences = (View(self.corpus, i, i)[key] for i in range(self.first, self.last + 1))
+                return ' '.join(s for s in sentences if s)
+            start, end = self.span(key)
+            return self.corpus.buffers[key][start:end]
+        if key == 'wmt_line' and self.merged:
+            return '{0}:{1}'.format(self.corpus.meta[self.first][1], self.corpus.meta[self.last][1])
+        return self.corpus.meta[self.first][META.index(key)]
+
+    def span(self, column):
+        """Start and end offsets in the buffer of `column`."""
+        return self.corpus.starts[column][self.first], self.corpus.ends[column][self.last]
+
+    def tokens(self, column):
+        """Returns the start and end offsets of all whitespace-separated
+        tokens of `column`, as two arrays."""
+        start, end = self.span(column)
+        starts, ends = array('q'), array('q')
+        for match in token.finditer(self.corpus.buffers[column], start, end):
+            starts.append(match.start())
+            ends.append(match.end())
+        return starts, ends
+
+
+class TokenSequence:
+    """Tokens of a buffer in a given order, joined by spaces when converted to
+    a string."""
+
+    __slots__ = ('buffer', 'starts', 'ends', 'order')
+
+    def __init__(self, buffer, starts, ends, order):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+        self.order = order
+
+    def __str__(self):
+        buffer, starts, ends = self.buffer, self.starts, self.ends
+        return ' '.join(buffer[starts[i]:ends[i]] for i in self.order)
@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 
-import sys
-import csv
 import random
 import logging
-from copy import deepcopy
 from argparse import ArgumentParser, FileType
 from collections import defaultdict
 
+from tables import read_table, TableWriter
+from design import Design, SAMPLING
+from corpus import Corpus
+from spam import TokenPool, STRATEGIES, make_spam, make_spam_batch
+import instrumentation
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
-random.seed(80469)
+SEED = 80469
+FIELDNAMES = [
+    'file_id', # e.g., 1d
+    'file_order', # e.g., 1
+    'task_id', # e.g., dd
+    'task_order', # e.g., 23
+    'wmt_article',
+    'wmt_line',
+    'src',
+    'A',
+    'B',
+    'A_origin',
+    'B_origin'
+]
 
 
 def random_range(start, end):
@@ -20,195 +34,238 @@ def random_range(start, end):
     return r
 
 
-def make_spam(string):
-    tokens = string.split()
-    d = len(tokens)//10 # leave the first and last 10% of tokens untouched
-    head = tokens[:d]
-    tail = tokens[len(tokens)-d:]
-    rest = tokens[d:len(tokens)-d]
-    random.shuffle(rest) # shufle the remaining tokens randomly
-    spam_tokens = head + rest + tail
-    return ' '.join(spam_tokens)
-
-
-def merge_sentences(sentences):
-    """Merges all sentences of an article into one item of type article."""
-    def merge(sents):
-        return ' '.join(sents)
-    return {
-        'wmt_article': sentences[0]['wmt_article'],
-        'wmt_line': '{0}:{1}'.format(sentences[0]['wmt_line'], sentences[-1]['wmt_line']),
-        'wmt_article_name': sentences[0]['wmt_article_name'],
-        'src': merge([s['src'] for s in sentences]),
-        'mt': merge([s['mt'] for s in sentences]),
-        'human_a': merge([s['human_a'] for s in sentences]),
-        'human_b': merge([s['human_b'] for s in sentences]) if 'human_b' in sentences[0] else '',
-    }
-
-
-def create_experimental_item(item, ab_choices):
+class ExperimentalItem:
+    """An A/B item. Refers to its source (a view on a sentence or article)
+    rather than copying it; A and B are looked up when the item is written."""
+
+    __slots__ = ('source', 'spam', 'A_origin', 'B_origin',
+                 'task_id', 'task_order', 'file_id', 'file_order')
+
+    def __init__(self, source, A_origin, B_origin, spam=None):
+        self.source = source
+        self.spam = spam
+        self.A_origin = A_origin
+        self.B_origin = B_origin
+
+    def text(self, origin):
+        return str(self.spam) if origin == 'spam' else self.source[origin]
+
+    def as_row(self):
+        """Returns the item as a row of strings, as read back by `read_table`."""
+        return {
+            'file_id': self.file_id,
+            'file_order': str(self.file_order),
+            'task_id': self.task_id,
+            'task_order': str(self.task_order),
+            'wmt_article': self.source['wmt_article'],
+            'wmt_line': self.source['wmt_line'],
+            'src': self.source['src'],
+            'A': self.text(self.A_origin),
+            'B': self.text(self.B_origin),
+            'A_origin': self.A_origin,
+            'B_origin': self.B_origin,
+        }
+
+
+def create_experimental_item(item, ab_choices, spam=None):
     assert len(ab_choices) == 2, "A/B test item must have exactly two choices."
     for choice in ab_choices:
-        assert choice in item, "Unknown origin: " + choice
-    exp_item = deepcopy(item)
-    choices = [
-        (exp_item[ab_choices[0]], ab_choices[0]),
-        (exp_item[ab_choices[1]], ab_choices[1])
-    ]
+        assert choice in item or choice == 'spam', "Unknown origin: " + choice
+    choices = list(ab_choices)
     random.shuffle(choices)
-    exp_item['A'] = choices[0][0]
-    exp_item['A_origin'] = choices[0][1]
-    exp_item['B'] = choices[1][0]
-    exp_item['B_origin'] = choices[1][1]
-    return exp_item
+    return ExperimentalItem(item, choices[0], choices[1], spam=spam)
 
 
-def create_experimental_spam_item(article, level):
+def create_experimental_spam_item(corpus, pool, article, level, reference):
     if level == 's': # sentence
         item = random.choice(article) # chose a random sentence
     elif level == 'd': # document
-        item = merge_sentences(article)
-    item['spam'] = make_spam(item['mt'])
-    ab_choices = ('human_a', 'spam')
-    return create_experimental_item(item, ab_choices)
-
-
-parser = ArgumentParser(description='Creates A/B rating tasks from output of'
-                                    '`combine_data.py`.')
-parser.add_argument('data', type=FileType('r'), help='The WMT 2018 ZH-EN data '
-                                                     'with alternative '
-                                                     'translations (output of '
-                                                     '`combine_data.py`.)')
-parser.add_argument('-d', '--documents', type=int, default=50,
-                    help='Number of documents per rater.')
-parser.add_argument('-ds', '--documents_spam', type=int, default=3,
-                    help='Number of spam documents per task.')
-parser.add_argument('-s', '--sentences', type=int, default=104,
-                    help='Number of sentences per rater.')
-parser.add_argument('-ss', '--sentences_spam', type=int, default=8,
-                    help='Number of spam sentences per task.')
-parser.add_argument('-o', '--output', type=FileType('w'), default=sys.stdout,
-                    help='Output file (CSV). Defaults to stdout.')
-
-args = parser.parse_args()
-
-# collect data
-articles = defaultdict(list)
-articles_with_human_b = set()
-for sentence in csv.DictReader(args.data):
-    articles[sentence['wmt_article']].append(sentence)
-    if sentence['human_b'] != '':
-        articles_with_human_b.add(sentence['wmt_article'])
-sents_per_article = [len(article) for article in articles.values()]
-logging.info('Input: %s articles, %s containing `human_b`.', len(articles), len(articles_with_human_b))
-
-# sample 50 articles and 104 sentences containing human_b, in random order
-random_article_ids = []
-random_sentences = []
-articles_with_human_b = sorted(articles_with_human_b)
-while not (len(random_sentences) >= args.sentences):
-    random_sentences = []
-    random.shuffle(articles_with_human_b)
-    random_article_ids = articles_with_human_b[:args.documents]
-    for article_id in articles_with_human_b[args.documents:]:
-        random_sentences.extend(articles[article_id])
-random_articles = [merge_sentences(articles[i]) for i in random_article_ids]
-random_sentences = random_sentences[:args.sentences]
-random.shuffle(random_sentences)
-
-# prepare spam items
-
-# Spam items are created from articles for which human_b is not available.
-# We render mt nonsensical and expect raters to chose human_a.
-
-articles_without_human_b = [articles[i] for i in articles.keys() if i not in articles_with_human_b]
-random.shuffle(articles_without_human_b)
-
-# compose experiment
-
-# task | raters  | condition           | items       | level    | file
-# cd   | group 1 | mt vs. human_b      | first half  | document | 1d
-# cs   | group 1 | mt vs. human_b      | first half  | sentence | 1s
-# dd   | group 1 | human_a vs. human_b | second half | document | 1d
-# ds   | group 1 | human_a vs. human_b | second half | sentence | 1s
-# ed   | group 2 | mt vs. human_b      | second half | document | 2d
-# es   | group 2 | mt vs. human_b      | second half | sentence | 2s
-# fd   | group 2 | human_a vs. human_b | first half  | document | 2d
-# fs   | group 2 | human_a vs. human_b | first half  | sentence | 2s
-
-all_experimental_items = []
-
-file_mapping = {
-    'cd': '1d',
-    'cs': '1s',
-    'dd': '1d',
-    'ds': '1s',
-    'ed': '2d',
-    'es': '2s',
-    'fd': '2d',
-    'fs': '2s'
-}
-
-file_order = {
-    '1d': random_range(1, args.documents + args.documents_spam * 2 + 1),
-    '1s': random_range(1, args.sentences + args.sentences_spam * 2 + 1),
-    '2d': random_range(1, args.documents + args.documents_spam * 2 + 1),
-    '2s': random_range(1, args.sentences + args.sentences_spam * 2 + 1)
-}
-
-for level, all_items in zip('ds', [random_articles, random_sentences]):
-    for task, a_choice, items in zip('cdef', [
-            'mt',
-            'human_a',
-            'mt',
-            'human_a'
-        ], [
-            all_items[int(len(all_items)/2):],
-            all_items[:int(len(all_items)/2)],
-            all_items[:int(len(all_items)/2)],
-            all_items[int(len(all_items)/2):]
-        ]):
+        item = corpus.document(article[0]['wmt_article'])
+    spam = make_spam(pool, item, random)
+    ab_choices = (reference, 'spam')
+    return create_experimental_item(item, ab_choices, spam=spam)
+
+
+def create_spam_sources(corpus, articles, design, rng):
+    """Samples the sources of all spam items of `design` from `articles`: one
+    article per document-level item, one sentence per sentence-level item.
+    Returns a dict of level => list of views."""
+    sentences = [sentence for article in articles for sentence in article]
+    sources = {}
+    for level, pool in (('d', articles), ('s', sentences)):
+        needed = sum(design.spam[task.level] for task in design.tasks() if task.level == level)
+        if needed > len(pool):
+            raise ValueError('The design needs {0} {1}-level spam items, but only {2} are '
+                             'available.'.format(needed, level, len(pool)))
+        sources[level] = rng.sample(pool, needed)
+    sources['d'] = [corpus.document(article[0]['wmt_article']) for article in sources['d']]
+    return sources
+
+
+def create_experiment(rows, design=None, sampling='single-pass', seed=SEED, spam=None):
+    """Creates experimental items from rows of `combine_data.py` output,
+    according to `design` (the design of `items.csv` by default). Returns the
+    items ordered by file and order number.
+
+    By default, each spam item is a whole article or a random sentence of it,
+    with shuffled tokens, created along with the regular items as for
+    `items.csv`. If `spam` is a list of strategies (see `spam.py`), spam items
+    are created in one batch instead, from their own random generator, and
+    several sentences of an article can be used as sentence-level spam."""
+    design = design or Design()
+    random.seed(seed)
+
+    # collect data
+    articles = defaultdict(list)
+    articles_with_human_b = set() # all origins needed for the design are available
+    complete = defaultdict(list) # article id => whether each sentence has all origins
+    origins = design.origins
+    for sentence in rows:
+        articles[sentence['wmt_article']].append(sentence)
+        has_origins = all(sentence.get(origin) for origin in origins)
+        complete[sentence['wmt_article']].append(has_origins)
+        if has_origins:
+            articles_with_human_b.add(sentence['wmt_article'])
+    corpus = Corpus(articles)
+    design.check_columns(corpus.columns) # before sampling
+    articles = corpus.articles # sentence views instead of rows
+    # sentences are only sampled if they have all origins: e.g., a sentence
+    # translated together with the previous one has no translation of its own
+    sentences_with_human_b = {i: [view for view, ok in zip(articles[i], complete[i]) if ok]
+                              for i in articles_with_human_b}
+    logging.info('Input: %s articles, %s containing `%s`.', len(articles), len(articles_with_human_b), '`, `'.join(design.origins))
+
+    # sample articles and sentences containing all origins, in random order
+    random_article_ids, random_sentences = SAMPLING[sampling](
+        sentences_with_human_b, sorted(articles_with_human_b), design.items['d'], design.items['s'])
+    random_articles = [corpus.document(i) for i in random_article_ids]
+    random_sentences = random_sentences[:design.items['s']]
+    random.shuffle(random_sentences)
+
+    # prepare spam items
+
+    # Spam items are created from articles for which human_b is not available.
+    # We render the spam source (mt) nonsensical and expect raters to chose
+    # the reference (human_a).
+
+    articles_without_human_b = [articles[i] for i in articles.keys() if i not in articles_with_human_b]
+    pool = TokenPool(corpus, design.spam_source)
+    if spam:
+        rng = random.Random('{0}-spam'.format(seed))
+        sources = create_spam_sources(corpus, articles_without_human_b, design, rng)
+        ab_choices = (design.spam_reference, 'spam')
+        spam_items = {level: iter([create_experimental_item(view, ab_choices, spam=text)
+                                   for view, text in zip(views, make_spam_batch(pool, views, spam, rng))])
+                      for level, views in sources.items()}
+    else:
+        random.shuffle(articles_without_human_b)
+        num_spam_items = sum(design.spam[task.level] for task in design.tasks())
+        if num_spam_items > len(articles_without_human_b):
+            raise ValueError('The design needs {0} spam items, but only {1} articles without `{2}` '
+                             'are available.'.format(num_spam_items, len(articles_without_human_b),
+                                                     '`, `'.join(design.origins)))
+        spam_articles = reversed(articles_without_human_b)
+
+    # compose experiment (see `design.py`)
+
+    all_experimental_items = []
+
+    file_order = {file_id: reversed(random_range(1, design.file_size(file_id[-1]) + 1))
+                  for file_id in design.file_ids()}
+
+    sampled_items = {'d': random_articles, 's': random_sentences}
+    for task in design.tasks():
         experimental_items = []
-        task_id = task + level
-        ab_choices = (a_choice, 'human_b')
+        items = design.parts(sampled_items[task.level])[task.part]
         # regular items
         for item in items:
-            item = create_experimental_item(item, ab_choices)
+            item = create_experimental_item(item, task.condition)
             experimental_items.append(item)
         # spam items
-        num_spam_items = args.documents_spam if level == 'd' else args.sentences_spam
-        for _ in range(num_spam_items):
-            article = articles_without_human_b.pop()
-            item = create_experimental_spam_item(article, level)
+        for _ in range(design.spam[task.level]):
+            if spam:
+                item = next(spam_items[task.level])
+            else:
+                article = next(spam_articles)
+                item = create_experimental_spam_item(corpus, pool, article, task.level,
+                                                     design.spam_reference)
             experimental_items.append(item)
         # shuffle spam and regular items
         random.shuffle(experimental_items)
         # add task_id, order
         for i, item in enumerate(experimental_items, start=1):
-            item['task_id'] = task_id
-            item['task_order'] = i
-            item['file_id'] = file_mapping[task_id]
-            item['file_order'] = file_order[item['file_id']].pop()
+            item.task_id = task.task_id
+            item.task_order = i
+            item.file_id = task.file_id
+            item.file_order = next(file_order[task.file_id])
         all_experimental_items.extend(experimental_items)
 
-# sort items by file_id, file_order ASC
-all_experimental_items = sorted(all_experimental_items,
-                                key=lambda x: (x['file_id'], x['file_order']))
+    # sort items by file_id, file_order ASC
+    return sorted(all_experimental_items, key=lambda x: (x.file_id, x.file_order))
 
-# write experimental data
-writer = csv.DictWriter(args.output, extrasaction="ignore", fieldnames=[
-    'file_id', # e.g., 1d
-    'file_order', # e.g., 1
-    'task_id', # e.g., dd
-    'task_order', # e.g., 23
-    'wmt_article',
-    'wmt_line',
-    'src',
-    'A',
-    'B',
-    'A_origin',
-    'B_origin'
-])
-writer.writeheader()
-for item in all_experimental_items:
-    writer.writerow(item)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = ArgumentParser(description='Creates A/B rating tasks from output of'
+                                        '`combine_data.py`.')
+    parser.add_argument('data', help='The WMT 2018 ZH-EN data '
+                                     'with alternative '
+                                     'translations (output of '
+                                     '`combine_data.py`, CSV '
+                                     'or SQLite.)')
+    parser.add_argument('--design', type=FileType('r'),
+                        help='Experimental design (JSON) with any of the keys groups, '
+                             'conditions, documents, documents_spam, sentences, and '
+                             'sentences_spam. Defaults to the design of `items.csv`.')
+    parser.add_argument('--sampling', choices=sorted(SAMPLING), default='single-pass',
+                        help='How documents and sentences are sampled. Use `rejection` '
+                             'to reproduce `items.csv` (default: single-pass).')
+    parser.add_argument('-d', '--documents', type=int,
+                        help='Number of documents per rater (default: 50).')
+    parser.add_argument('-ds', '--documents_spam', type=int,
+                        help='Number of spam documents per task (default: 3).')
+    parser.add_argument('-s', '--sentences', type=int,
+                        help='Number of sentences per rater (default: 104).')
+    parser.add_argument('-ss', '--sentences_spam', type=int,
+                        help='Number of spam sentences per task (default: 8).')
+    parser.add_argument('--spam', action='append', choices=sorted(STRATEGIES), metavar='STRATEGY',
+                        help='Create all spam items in one batch, using this strategy, one of '
+                             '%(choices)s. Can be repeated to use several strategies in turn. '
+                             'By default, spam items are created as for `items.csv`.')
+    parser.add_argument('-o', '--output', default='-',
+                        help='Output file (CSV, or SQLite if it ends in .sqlite). '
+                             'Defaults to stdout.')
+    instrumentation.add_arguments(parser)
+
+    args = parser.parse_args()
+    instruments = instrumentation.from_arguments(__file__, args)
+
+    overrides = dict(documents=args.documents, documents_spam=args.documents_spam,
+                     sentences=args.sentences, sentences_spam=args.sentences_spam)
+    try:
+        if args.design:
+            design = Design.from_json(args.design, **overrides)
+        else:
+            design = Design(**{k: v for k, v in overrides.items() if v is not None})
+    except (ValueError, TypeError) as e:
+        parser.error('Invalid design: {0}'.format(e))
+
+    with instruments.stage('read') as stage:
+        rows = list(read_table(args.data))
+        stage.rows = len(rows)
+    try:
+        with instruments.stage('sample') as stage:
+            items = create_experiment(rows, design, args.sampling, spam=args.spam)
+            stage.rows = len(items)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # write experimental data
+    with instruments.stage('write') as stage:
+        with TableWriter(args.output, fieldnames=FIELDNAMES) as writer:
+            for item in items:
+                writer.writerow(item.as_row())
+        stage.rows = len(items)
+        stage.bytes_written = writer.bytes_written
+    instruments.close(args.metrics)
@@ -1,24 +1,64 @@
 #!/usr/bin/env python3
 
 import os
-import csv
 import logging
+from functools import lru_cache, partial
 from collections import defaultdict
-from argparse import ArgumentParser, FileType
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 
+from tables import read_table
+import instrumentation
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+HTML_HEAD = '''
+    <!DOCTYPE html>
+    <html>
+      <head>
+        <meta charset="utf-8" />
+        <title>Rate Texts</title>
+        <style>
+            '''
+HTML_STYLE_END = '''
+        </style>
+      </head>
+      <body>
+        '''
+HTML_INSTRUCTIONS_END = '''
+        '''
+HTML_TAIL = '''
+      </body>
+    </html>
+    '''
+
+# paginated mode: pages link to a shared style sheet, and items are numbered
+# continuously across pages
+HTML_PAGE_HEAD = '''<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8" />
+    <title>Rate Texts ({0})</title>
+    <link rel="stylesheet" href="style.css" />
+  </head>
+  <body style="counter-reset: item-counter {1}">
+'''
+HTML_PAGE_TAIL = '''
+  </body>
+</html>
+'''
 
 
 def num_words(text):
     return len(text.split()) # no real tokenization, just split on whitespace
 
 
+@lru_cache(maxsize=None)
 def get_css():
     with open('templates/style.css') as f:
         return f.read()
 
 
+@lru_cache(maxsize=None)
 def get_html_instructions(monolingual=False):
     filename = 'instructions-{0}.html'.format('monolingual' if monolingual else 'bilingual')
     with open('templates/' + filename) as f:
@@ -26,66 +66,144 @@ def get_html_instructions(monolingual=False):
 
 
 def get_html_body(items, monolingual=False):
+    """Yields the HTML of each item."""
     mode = 'm' if monolingual else 'b'
-    html_body = ''
     for item in items:
         item_id = '{0}{1}-{2}'.format(mode, item['file_id'], item['file_order'])
-        html_body += '<div class="item">'
-        html_body += '\n\t<div class="title" id="{0}">{0}</div>'.format(item_id)
+        html_item = ['<div class="item">']
+        html_item.append('\n\t<div class="title" id="{0}">{0}</div>'.format(item_id))
         if not monolingual:
-            html_body += '\n\t<div class="source" id="{0}">{1}</div>'.format(item_id, item['src'])
-        html_body += '\n\t<div class="translation" id="{0}">{1}</div>'.format(item_id, item['A'])
-        html_body += '\n\t<div class="translation" id="{0}">{1}</div>'.format(item_id, item['B'])
-        html_body += '\n</div>\n\n'
-    return html_body
-
-
-def get_html(items, monolingual=False):
-    css = get_css()
-    instructions = get_html_instructions(monolingual=monolingual)
-    body = get_html_body(items, monolingual=monolingual)
-    return '''
-    <!DOCTYPE html>
-    <html>
-      <head>
-        <meta charset="utf-8" />
-        <title>Rate Texts</title>
-        <style>
-            {0}
-        </style>
-      </head>
-      <body>
-        {1}
-        {2}
-      </body>
-    </html>
-    '''.format(css, instructions, body)
-
-
-parser = ArgumentParser(description='Creates standalone HTML for each task in'
-                                    'the CSV output of `create_experiment.py`.')
-parser.add_argument('data', type=FileType('r'), help='The CSV output of '
-                                                     '`create_experiment.py`.)')
-parser.add_argument('-d', '--directory', default=os.getcwd(),
-                    help='Output directory (default: current working directory).')
-
-args = parser.parse_args()
-
-# read data
-files = defaultdict(list)
-for item in csv.DictReader(args.data):
-    files[item['file_id']].append(item)
-
-# create html
-for file_id, items in files.items():
-    num_src_chars = sum([len(i['src']) for i in items])
-    num_trg_chars = sum([len(i['A']) + len(i['B']) for i in items])
-    num_trg_words = sum([num_words(i['A']) + num_words(i['B']) for i in items])
-    logging.info('File %s: %s items, %s src chars, %s trg chars (%s words).',
-                 file_id, len(items), num_src_chars, num_trg_chars, num_trg_words)
-    for monolingual in [False, True]:
-        prefix = 'm' if monolingual else 'b'
-        target_file = args.directory + '/' + prefix + file_id + '.html'
-        html = get_html(items, monolingual=monolingual)
-        with open(target_file, 'w') as f:
-            f.write(html)
+            html_item.append('\n\t<div class="source" id="{0}">{1}</div>'.format(item_id, item['src']))
+        html_item.append('\n\t<div class="translation" id="{0}">{1}</div>'.format(item_id, item['A']))
+        html_item.append('\n\t<div class="translation" id="{0}">{1}</div>'.format(item_id, item['B']))
+        html_item.append('\n</div>\n\n')
+        yield ''.join(html_item)
+
+
+def write_html(f, items, monolingual=False):
+    """Writes a standalone HTML page with all `items` to file handle `f`."""
+    f.write(HTML_HEAD)
+    f.write(get_css())
+    f.write(HTML_STYLE_END)
+    f.write(get_html_instructions(monolingual=monolingual))
+    f.write(HTML_INSTRUCTIONS_END)
+    f.writelines(get_html_body(items, monolingual=monolingual))
+    f.write(HTML_TAIL)
+
+
+def create_html_file(target_file, items, monolingual=False):
+    with open(target_file, 'w') as f:
+        write_html(f, items, monolingual=monolingual)
+    return [(target_file, os.path.getsize(target_file))]
+
+
+def get_html_navigation(page_files, page):
+    """Links to the previous page, the overview, and the next page."""
+    links = []
+    if page > 0:
+        links.append('<a href="{0}">previous</a>'.format(os.path.basename(page_files[page - 1])))
+    links.append('page {0} of {1}'.format(page + 1, len(page_files) - 1))
+    if page + 1 < len(page_files) - 1:
+        links.append('<a href="{0}">next</a>'.format(os.path.basename(page_files[page + 1])))
+    return '<p class="navigation" style="clear: both">{0}</p>\n'.format(' | '.join(links))
+
+
+def create_paginated_files(target_file, items, monolingual=False, page_size=10):
+    """Writes `items` to pages of `page_size` items each, plus `target_file`
+    with the instructions and links to all pages. Returns the path and size
+    in bytes of each file written."""
+    stem = target_file[:-len('.html')]
+    num_pages = (len(items) + page_size - 1) // page_size
+    page_files = ['{0}-{1}.html'.format(stem, page + 1) for page in range(num_pages)]
+    page_files.append(target_file) # overview, last so that pages are 0-indexed
+    title = os.path.basename(stem)
+    for page in range(num_pages):
+        start = page * page_size
+        with open(page_files[page], 'w') as f:
+            f.write(HTML_PAGE_HEAD.format(title, start))
+            f.write(get_html_navigation(page_files, page))
+            f.writelines(get_html_body(items[start:start + page_size], monolingual=monolingual))
+            f.write(get_html_navigation(page_files, page))
+            f.write(HTML_PAGE_TAIL)
+    with open(target_file, 'w') as f:
+        f.write(HTML_PAGE_HEAD.format(title, 0))
+        f.write(get_html_instructions(monolingual=monolingual))
+        f.write('<ol>\n')
+        for page in range(num_pages):
+            first, last = items[page * page_size], items[min(len(items), (page + 1) * page_size) - 1]
+            f.write('<li><a href="{0}">items {1} to {2}</a></li>\n'.format(
+                os.path.basename(page_files[page]), first['file_order'], last['file_order']))
+        f.write('</ol>\n')
+        f.write(HTML_PAGE_TAIL)
+    return [(path, os.path.getsize(path)) for path in page_files]
+
+
+def create_html(items, directory, page_size=None, jobs=1):
+    """Creates HTML files in `directory` for the rows of `create_experiment.py`
+    output in `items`, in a monolingual and a bilingual variant each. Returns
+    the path and size in bytes of each file written."""
+    files = defaultdict(list)
+    for item in items:
+        files[item['file_id']].append(item)
+
+    tasks = []
+    for file_id, items in files.items():
+        num_src_chars = sum([len(i['src']) for i in items])
+        num_trg_chars = sum([len(i['A']) + len(i['B']) for i in items])
+        num_trg_words = sum([num_words(i['A']) + num_words(i['B']) for i in items])
+        logging.info('File %s: %s items, %s src chars, %s trg chars (%s words).',
+                     file_id, len(items), num_src_chars, num_trg_chars, num_trg_words)
+        for monolingual in [False, True]:
+            prefix = 'm' if monolingual else 'b'
+            target_file = directory + '/' + prefix + file_id + '.html'
+            tasks.append((target_file, items, monolingual))
+
+    css = []
+    if page_size:
+        with open(directory + '/style.css', 'w') as f:
+            f.write(get_css())
+        css.append((directory + '/style.css', os.path.getsize(directory + '/style.css')))
+        create = partial(create_paginated_files, page_size=page_size)
+    else:
+        create = create_html_file
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            written = list(executor.map(create, *zip(*tasks)))
+    else:
+        written = [create(*task) for task in tasks]
+    return [path_and_size for files_written in written for path_and_size in files_written] + css
+
+
+if __name__ == '__main__': # worker processes import this module
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = ArgumentParser(description='Creates standalone HTML for each task in'
+                                        'the CSV output of `create_experiment.py`.')
+    parser.add_argument('data', help='The output of `create_experiment.py` '
+                                     '(CSV or SQLite).')
+    parser.add_argument('-d', '--directory', default=os.getcwd(),
+                        help='Output directory (default: current working directory).')
+    parser.add_argument('-p', '--page-size', type=int,
+                        help='Split each file into pages of this many items, plus an overview '
+                             'page with the instructions. By default, each file is a single '
+                             'standalone page.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of files written in parallel (default: number of CPUs).')
+    instrumentation.add_arguments(parser)
+
+    args = parser.parse_args()
+    instruments = instrumentation.from_arguments(__file__, args)
+    if args.page_size is not None and args.page_size < 1:
+        parser.error('Page size must be at least 1.')
+
+    with instruments.stage('read') as stage:
+        items = list(read_table(args.data))
+        stage.rows = len(items)
+    with instruments.stage('render') as stage:
+        written = create_html(items, args.directory, args.page_size, args.jobs)
+        stage.rows = len(items)
+        stage.bytes_written = sum(size for _, size in written)
+    if args.page_size:
+        for path, size in written:
+            logging.info('Wrote %s (%s bytes).', path, size)
+    instruments.close(args.metrics)
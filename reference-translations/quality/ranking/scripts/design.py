@@ -0,0 +1,185 @@
+"""Experimental designs for A/B rating tasks.
+
+A design is declared by the number of rater groups, the conditions (pairs of
+origins to compare), and the number of regular and spam items per condition
+and level. Items of each level are split into as many parts as there are
+conditions, and each group rates every part under a different condition
+(Latin square). Each group rates one file per level.
+
+The default design is the one used for `items.csv`:
+
+task | raters  | condition           | items       | level    | file
+cd   | group 1 | mt vs. human_b      | second half | document | 1d
+cs   | group 1 | mt vs. human_b      | second half | sentence | 1s
+dd   | group 1 | human_a vs. human_b | first half  | document | 1d
+ds   | group 1 | human_a vs. human_b | first half  | sentence | 1s
+ed   | group 2 | mt vs. human_b      | first half  | document | 2d
+es   | group 2 | mt vs. human_b      | first half  | sentence | 2s
+fd   | group 2 | human_a vs. human_b | second half | document | 2d
+fs   | group 2 | human_a vs. human_b | second half | sentence | 2s
+
+Spam items are made from `spam_source` (default: mt) and compared with
+`spam_reference` (default: human_a), which raters are expected to prefer.
+"""
+
+import json
+import random
+import string
+from collections import namedtuple
+
+
+LEVELS = ('d', 's') # document, sentence
+TASK_LETTERS = string.ascii_lowercase[2:] # task ids start at "c"
+
+Task = namedtuple('Task', ['task_id', 'group', 'condition', 'part', 'level', 'file_id'])
+
+
+def task_prefix(index):
+    """Returns "c", "d", ..., "z", "cc", "cd", ... for 0, 1, ..."""
+    prefix = ''
+    while True:
+        index, remainder = divmod(index, len(TASK_LETTERS))
+        prefix = TASK_LETTERS[remainder] + prefix
+        if index == 0:
+            return prefix
+        index -= 1
+
+
+class Design:
+
+    def __init__(self, groups=2, conditions=(('mt', 'human_b'), ('human_a', 'human_b')),
+                 documents=50, documents_spam=3, sentences=104, sentences_spam=8,
+                 spam_source='mt', spam_reference='human_a'):
+        if groups < 1:
+            raise ValueError('A design needs at least one group.')
+        if not conditions or any(len(c) != 2 for c in conditions):
+            raise ValueError('Each condition must compare exactly two origins.')
+        self.groups = groups
+        self.conditions = [tuple(c) for c in conditions]
+        self.items = {'d': documents, 's': sentences} # per group, all conditions
+        self.spam = {'d': documents_spam, 's': sentences_spam} # per task
+        self.spam_source = spam_source
+        self.spam_reference = spam_reference
+
+    @classmethod
+    def from_json(cls, f, **overrides):
+        """Reads a design from a JSON object with any of the keyword arguments
+        of `Design()`. Values in `overrides` that are not None take
+        precedence."""
+        spec = json.load(f)
+        spec.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**spec)
+
+    @property
+    def origins(self):
+        """All origins that an article must contain to be sampled."""
+        return sorted(set(o for c in self.conditions for o in c))
+
+    def check_columns(self, columns):
+        """Raises a ValueError if any origin of the design, including those of
+        spam items, is not among `columns`."""
+        needed = self.origins + [self.spam_source, self.spam_reference]
+        missing = sorted(set(o for o in needed if o not in columns))
+        if missing:
+            raise ValueError('The design uses `{0}`, which the data does not contain (only `{1}`).'.format(
+                '`, `'.join(missing), '`, `'.join(columns)))
+
+    def tasks(self):
+        """Returns all tasks, ordered by level, group and condition."""
+        tasks = []
+        for level in LEVELS:
+            index = 0
+            for group in range(self.groups):
+                for condition in range(len(self.conditions)):
+                    tasks.append(Task(
+                        task_id=task_prefix(index) + level,
+                        group=group,
+                        condition=self.conditions[condition],
+                        part=(group + condition + 1) % len(self.conditions),
+                        level=level,
+                        file_id='{0}{1}'.format(group + 1, level),
+                    ))
+                    index += 1
+        return tasks
+
+    def file_ids(self):
+        return ['{0}{1}'.format(group + 1, level)
+                for group in range(self.groups) for level in LEVELS]
+
+    def file_size(self, level):
+        """Number of items (including spam) per file."""
+        return self.items[level] + self.spam[level] * len(self.conditions)
+
+    def parts(self, items):
+        """Splits `items` into one part per condition."""
+        n = len(self.conditions)
+        bounds = [int(len(items) * i / n) for i in range(n + 1)]
+        return [items[bounds[i]:bounds[i+1]] for i in range(n)]
+
+
+def check_capacity(articles, article_ids, documents, sentences):
+    """Raises a ValueError if no sample of `documents` articles leaves
+    `sentences` sentences in the remaining articles."""
+    if len(article_ids) < documents:
+        raise ValueError('Cannot sample {0} documents from {1} articles.'.format(
+            documents, len(article_ids)))
+    lengths = sorted(len(articles[i]) for i in article_ids)
+    if sum(lengths[documents:]) < sentences:
+        raise ValueError('Cannot sample {0} sentences from articles other than the {1} '
+                         'sampled documents.'.format(sentences, documents))
+
+
+def sample_rejection(articles, article_ids, documents, sentences):
+    """Samples `documents` articles, and `sentences` sentences from the
+    remaining articles, by reshuffling until there are enough sentences. This
+    is how `items.csv` was created."""
+    article_ids = list(article_ids)
+    check_capacity(articles, article_ids, documents, sentences)
+    random_article_ids = []
+    random_sentences = []
+    while not (len(random_sentences) >= sentences):
+        random_sentences = []
+        random.shuffle(article_ids)
+        random_article_ids = article_ids[:documents]
+        for article_id in article_ids[documents:]:
+            random_sentences.extend(articles[article_id])
+    return random_article_ids, random_sentences
+
+
+def sample_single_pass(articles, article_ids, documents, sentences):
+    """Samples `documents` articles, and `sentences` sentences from the
+    remaining articles, in a single pass. Documents are stratified by length:
+    the articles are sorted by number of sentences and split into `documents`
+    strata of about the same size, and one article is drawn from each, so that
+    short and long articles are sampled alike. If the remaining articles are
+    too short, the longest sampled articles are swapped with the shortest
+    remaining ones until there are enough sentences."""
+    article_ids = list(article_ids)
+    check_capacity(articles, article_ids, documents, sentences)
+    by_length = sorted(article_ids, key=lambda i: len(articles[i]))
+    bounds = [len(by_length) * s // documents for s in range(documents + 1)]
+    sampled = [random.choice(by_length[start:stop]) for start, stop in zip(bounds, bounds[1:])]
+    random.shuffle(sampled)
+    chosen = set(sampled)
+    remaining = [i for i in article_ids if i not in chosen]
+    random.shuffle(remaining)
+    deficit = sentences - sum(len(articles[i]) for i in remaining)
+    if deficit > 0:
+        longest = sorted(range(len(sampled)), key=lambda i: -len(articles[sampled[i]]))
+        shortest = sorted(range(len(remaining)), key=lambda i: len(articles[remaining[i]]))
+        for i, j in zip(longest, shortest):
+            gain = len(articles[sampled[i]]) - len(articles[remaining[j]])
+            if gain <= 0 or deficit <= 0:
+                break
+            sampled[i], remaining[j] = remaining[j], sampled[i]
+            deficit -= gain
+    random_sentences = []
+    for article_id in remaining:
+        random_sentences.extend(articles[article_id])
+    return sampled, random_sentences
+
+
+SAMPLING = {
+    'single-pass': sample_single_pass,
+    'rejection': sample_rejection,
+}
@@ -0,0 +1,130 @@
+"""Timing and resource usage of the stages of a script.
+
+Each stage records its wall time, the peak resident set size of the process
+at its end, the number of rows it processed and the number of bytes it
+wrote. With `--metrics`, scripts write these as JSON, e.g.:
+
+    {"script": "create_html.py", "wall_time": 0.41, "stages": [
+      {"stage": "read", "wall_time": 0.05, "rows": 704, "rows_per_sec": 14080.0,
+       "bytes_written": 0, "peak_rss": 31457280}, ...]}
+
+`--profile FILE` additionally runs the script under cProfile and writes the
+statistics to FILE (see `python -m pstats FILE`), and `--trace-memory` adds
+the peak size of memory allocated by Python in each stage (`peak_traced`).
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+from argparse import FileType
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # kilobytes on Linux
+
+
+class Stage:
+
+    __slots__ = ('name', 'rows', 'bytes_written', 'wall_time', 'peak_rss', 'peak_traced')
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.bytes_written = 0
+        self.wall_time = None
+        self.peak_rss = None
+        self.peak_traced = None
+
+    def as_dict(self):
+        report = {
+            'stage': self.name,
+            'wall_time': round(self.wall_time, 6),
+            'rows': self.rows,
+            'rows_per_sec': round(self.rows / self.wall_time, 1) if self.wall_time else None,
+            'bytes_written': self.bytes_written,
+            'peak_rss': self.peak_rss,
+        }
+        if self.peak_traced is not None:
+            report['peak_traced'] = self.peak_traced
+        return report
+
+
+class Instrumentation:
+
+    def __init__(self, script, profile=None, trace_memory=False):
+        self.script = os.path.basename(script)
+        self.stages = []
+        self.start = time.perf_counter()
+        self.profile = profile
+        self.profiler = None
+        self.trace_memory = trace_memory
+        if trace_memory:
+            tracemalloc.start()
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        """Measures the code run in the `with` block. Set `rows` and
+        `bytes_written` of the yielded stage to record throughput."""
+        stage = Stage(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_time = time.perf_counter() - start
+            stage.peak_rss = peak_rss()
+            if self.trace_memory:
+                stage.peak_traced = tracemalloc.get_traced_memory()[1]
+            self.stages.append(stage)
+
+    def report(self):
+        return {
+            'script': self.script,
+            'wall_time': round(time.perf_counter() - self.start, 6),
+            'peak_rss': peak_rss(),
+            'stages': [stage.as_dict() for stage in self.stages],
+        }
+
+    def close(self, metrics=None):
+        """Stops profiling and writes the report as JSON to `metrics` (a file
+        object), if given."""
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+        if self.trace_memory:
+            tracemalloc.stop()
+        if metrics is not None:
+            json.dump(self.report(), metrics, indent=2)
+            metrics.write('\n')
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', type=FileType('w'), nargs='?', const=sys.stderr,
+                        help='Write wall time, peak memory, rows/sec and bytes written per '
+                             'stage as JSON (to stderr if no file is given).')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Profile with cProfile and write statistics to FILE.')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Also record the peak memory allocated by Python per stage '
+                             '(slow).')
+
+
+def from_arguments(script, args):
+    return Instrumentation(script, profile=args.profile, trace_memory=args.trace_memory)
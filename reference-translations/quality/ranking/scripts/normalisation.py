@@ -0,0 +1,103 @@
+"""Normalisation of translated segments.
+
+Rules are character mappings that are compiled into one list of
+replacements. When a whole column is normalised at once, replacements for
+characters that do not occur in it are dropped up front. The remaining ones
+are applied with chained `str.replace` calls if there are few, and with a
+single regular expression otherwise. (`str.translate` is much slower than
+either in CPython if the table maps non-ASCII characters.) `nfkc` is special
+in that it applies Unicode NFKC normalisation first. Further rules can be
+added with `register_rule()`.
+"""
+
+import re
+import unicodedata
+
+
+RULES = {
+    'quotes': {
+        '“': '"',
+        '”': '"',
+        '‘': "'",
+        '’': "'",
+    },
+    'dashes': {
+        '‐': '-',
+        '‑': '-',
+        '‒': '-',
+        '–': '-',
+        '—': '-',
+        '―': '-',
+        '−': '-',
+    },
+    'fullwidth': dict(
+        [(chr(0xFF01 + i), chr(0x21 + i)) for i in range(94)] + [('　', ' ')]
+    ),
+}
+NFKC = 'nfkc'
+DEFAULT_RULES = ['quotes']
+MAX_CHAINED = 8 # use a regular expression for more replacements than this
+
+
+def register_rule(name, mapping):
+    """Adds a rule that replaces each key of `mapping` (a single character)
+    with its value (a string of any length)."""
+    if name == NFKC:
+        raise ValueError('Rule name is reserved: ' + name)
+    RULES[name] = dict(mapping)
+
+
+class Normaliser:
+    """Normalises segments according to a list of rule names."""
+
+    def __init__(self, rules=DEFAULT_RULES):
+        unknown = [r for r in rules if r != NFKC and r not in RULES]
+        if unknown:
+            raise ValueError('Unknown normalisation rule(s): ' + ', '.join(unknown))
+        self.nfkc = NFKC in rules
+        self.mapping = {}
+        for rule in rules:
+            if rule != NFKC:
+                self.mapping.update(RULES[rule])
+        self.replace = self.compile(list(self.mapping))
+
+    def compile(self, chars):
+        """Returns a function that applies the replacements for `chars`."""
+        mapping = self.mapping
+        if len(chars) <= MAX_CHAINED:
+            pairs = [(c, mapping[c]) for c in chars]
+            def replace(segment):
+                for char, replacement in pairs:
+                    segment = segment.replace(char, replacement)
+                return segment
+        else:
+            pattern = re.compile('[{0}]'.format(re.escape(''.join(chars))))
+            def replace(segment, substitute=lambda match: mapping[match.group()]):
+                return pattern.sub(substitute, segment)
+        return replace
+
+    def __call__(self, segment):
+        if self.nfkc:
+            segment = unicodedata.normalize('NFKC', segment)
+        return self.replace(segment).strip()
+
+    def normalise_all(self, segments):
+        """Normalises a list of segments (e.g., all lines of an article) at
+        once. This is faster than normalising them one by one if only some of
+        the rules' characters occur in them."""
+        if self.nfkc:
+            segments = [unicodedata.normalize('NFKC', s) for s in segments]
+        column = ''.join(segments)
+        chars = [c for c in self.mapping if c in column]
+        if not chars:
+            return [s.strip() for s in segments]
+        if len(chars) > MAX_CHAINED:
+            replace = self.compile(chars)
+            return [replace(s).strip() for s in segments]
+        pairs = [(c, self.mapping[c]) for c in chars]
+        normalised = []
+        for segment in segments:
+            for char, replacement in pairs:
+                segment = segment.replace(char, replacement)
+            normalised.append(segment.strip())
+        return normalised
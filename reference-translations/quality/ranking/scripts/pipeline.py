@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+"""Runs `combine_data.py`, `create_experiment.py`, `create_html.py` and,
+optionally, `combine_results.py` in a single process.
+
+Data is passed from stage to stage in memory. Intermediate files
+(`data.csv`, `items.csv`) are only written if a path is given, and
+stages can be run on their own by reading these files instead.
+
+With `--cache`, the output of each stage is cached under a fingerprint of
+its inputs, parameters and code (see `stage_cache.py`), and stages are
+only run if their fingerprint is new. `--explain` logs why.
+"""
+
+import os
+import sys
+import glob
+import shutil
+import logging
+from argparse import ArgumentParser, FileType
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tables import read_table, write_table
+from normalisation import RULES, NFKC, DEFAULT_RULES
+from combine_data import combine, fieldnames, system
+from create_experiment import create_experiment, FIELDNAMES, SEED
+from create_html import create_html
+from combine_results import combine_results, find_ratings
+from design import Design, SAMPLING
+from spam import STRATEGIES
+from stage_cache import StageCache, DEFAULT_MAX_SIZE, manifest, fingerprint, explain
+import instrumentation
+
+
+STAGES = ['combine_data', 'create_experiment', 'create_html', 'combine_results']
+DEFAULT_STAGES = STAGES[:3]
+TABLES = ['tables', 'store', 'ratings_index'] # `read_table` also reads stores
+CODE = { # modules whose source is part of a stage's fingerprint
+    'combine_data': ['combine_data', 'aligner', 'normalisation'] + TABLES,
+    'create_experiment': ['create_experiment', 'design', 'corpus', 'spam'] + TABLES,
+    'create_html': ['create_html'] + TABLES,
+    'combine_results': ['combine_results'] + TABLES,
+}
+TEMPLATES = 'templates'
+
+
+class Pipeline:
+    """Holds the output of each stage in memory. `data`, `items` and
+    `results` are paths that stage outputs are written to, and `data` and
+    `items` are read from if the stage producing them is not run."""
+
+    def __init__(self, src=None, systems=(), normalise=DEFAULT_RULES,
+                 design=None, sampling='single-pass', seed=SEED, spam=None,
+                 directory='.', page_size=None, jobs=1, ratings=(),
+                 index=':memory:', data=None, items=None, results=None,
+                 cache=None, explain=False, instruments=None):
+        self.src = src
+        self.systems = list(systems)
+        self.normalise = normalise
+        self.design = design or Design()
+        self.sampling = sampling
+        self.seed = seed
+        self.spam = spam
+        self.directory = directory
+        self.page_size = page_size
+        self.jobs = jobs
+        self.ratings = sorted(ratings)
+        self.index = index
+        self.data_path = data
+        self.items_path = items
+        self.results_path = results
+        self.cache = cache
+        self.explain = explain
+        self.instruments = instruments or instrumentation.Instrumentation(__file__)
+        self.keys = {} # stage => fingerprint of its output in this run
+        self.data = None # rows of combine_data output
+        self.items = None # rows of create_experiment output
+        self.html = None # (path, size) of each file written
+        self.results = None # (fieldnames, rows) of combine_results output
+
+    def cached(self, manifest, compute):
+        """Returns the output of `compute()` and the directory of its cached
+        files. If `manifest` has been seen before, the cached output is returned
+        without running `compute`, which returns the output and a list of
+        files to cache."""
+        stage = manifest['stage']
+        key = self.keys[stage] = fingerprint(manifest)
+        if self.cache is None:
+            return compute()[0], None
+        hit = self.cache.get(key)
+        if hit is not None:
+            logging.info('Using cached output of %s (%s).', stage, key[:12])
+        else:
+            if self.explain:
+                for reason in explain(self.cache.last_manifest(stage), manifest):
+                    logging.info('Running %s: %s.', stage, reason)
+            payload, files = compute()
+            self.cache.put(key, manifest, payload, files)
+            hit = payload, None
+        self.cache.record(manifest)
+        return hit
+
+    def upstream(self, stage, path):
+        """Returns the fingerprint of `stage` if it was run, or else `path` as
+        an input file."""
+        if stage in self.keys:
+            return self.keys[stage], []
+        return None, ([path] if path else [])
+
+    def combine_data(self):
+        if not self.src or not self.systems:
+            raise ValueError('combine_data needs a testset and at least one system.')
+        spec = manifest('combine_data', code=code('combine_data'),
+                        params={'systems': [name for name, _ in self.systems],
+                                'normalise': list(self.normalise)},
+                        inputs=[self.src] + [path for _, path in self.systems])
+        self.data, _ = self.cached(spec, lambda: (
+            list(combine(self.src, self.systems, self.normalise)), []))
+        if self.data_path:
+            write_table(self.data_path, fieldnames(self.systems), self.data)
+
+    def create_experiment(self):
+        upstream, inputs = self.upstream('combine_data', self.data_path)
+        spec = manifest('create_experiment', code=code('create_experiment'),
+                        params={'design': vars(self.design), 'sampling': self.sampling,
+                                'seed': self.seed, 'spam': self.spam},
+                        inputs=inputs, upstream=upstream)
+        def compute():
+            if self.data is None:
+                self.data = load(self.data_path, 'data')
+            items = create_experiment(self.data, self.design, self.sampling, self.seed, self.spam)
+            return [item.as_row() for item in items], []
+        self.items, _ = self.cached(spec, compute)
+        if self.items_path:
+            write_table(self.items_path, FIELDNAMES, self.items)
+
+    def create_html(self):
+        upstream, inputs = self.upstream('create_experiment', self.items_path)
+        spec = manifest('create_html', code=code('create_html'),
+                        params={'page_size': self.page_size},
+                        inputs=inputs + sorted(glob.glob(os.path.join(TEMPLATES, '*'))),
+                        upstream=upstream)
+        def compute():
+            if self.items is None:
+                self.items = load(self.items_path, 'items')
+            written = create_html(self.items, self.directory, self.page_size, self.jobs)
+            return [(os.path.basename(path), size) for path, size in written], \
+                   [path for path, _ in written]
+        os.makedirs(self.directory, exist_ok=True)
+        written, files = self.cached(spec, compute)
+        if files: # restore cached files
+            for name, _ in written:
+                shutil.copyfile(os.path.join(files, name), os.path.join(self.directory, name))
+        self.html = [(os.path.join(self.directory, name), size) for name, size in written]
+
+    def combine_results(self):
+        upstream, inputs = self.upstream('create_experiment', self.items_path)
+        spec = manifest('combine_results', code=code('combine_results'),
+                        inputs=inputs + self.ratings, upstream=upstream)
+        def compute():
+            if self.items is None:
+                self.items = load(self.items_path, 'items')
+            return combine_results(self.items, self.ratings, self.index), []
+        self.results, _ = self.cached(spec, compute)
+        if self.results_path:
+            write_table(self.results_path, *self.results)
+
+    def run(self, stages=DEFAULT_STAGES):
+        for stage in STAGES: # always in pipeline order
+            if stage in stages:
+                logging.info('Running %s.', stage)
+                with self.instruments.stage(stage) as record:
+                    getattr(self, stage)()
+                    record.rows = len(self.output(stage))
+                    if stage == 'create_html':
+                        record.bytes_written = sum(size for _, size in self.html)
+        if self.cache is not None:
+            for key in self.cache.evict():
+                logging.info('Removed %s from the cache.', key[:12])
+
+
+    def output(self, stage):
+        """The rows produced by `stage`."""
+        return {
+            'combine_data': self.data,
+            'create_experiment': self.items,
+            'create_html': self.items,
+            'combine_results': self.results and self.results[1],
+        }[stage]
+
+
+def code(stage):
+    return [sys.modules[name].__file__ for name in CODE[stage]]
+
+
+def load(path, name):
+    if not path:
+        raise ValueError('No {0} file given to read {0} from.'.format(name))
+    return list(read_table(path))
+
+
+if __name__ == '__main__': # worker processes import this module
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = ArgumentParser(description='Runs all stages from the WMT testset to rater '
+                                        'packets in a single process.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=DEFAULT_STAGES,
+                        help='Stages to run (default: all but combine_results).')
+    parser.add_argument('--src', help='The testset (see `combine_data.py`).')
+    parser.add_argument('--system', type=system, action='append', default=[], metavar='NAME=PATH',
+                        help='Translations, stored in column NAME (see `combine_data.py`). '
+                             'Can be repeated.')
+    parser.add_argument('--normalise', action='append', choices=sorted(RULES) + [NFKC], metavar='RULE',
+                        help='Normalisation rule, one of %(choices)s. Can be repeated. '
+                             'Defaults to quotes.')
+    parser.add_argument('--data', help='Output of `combine_data`: written if the stage is '
+                                       'run, read otherwise (CSV or SQLite).')
+    parser.add_argument('--items', help='Output of `create_experiment`: written if the stage '
+                                        'is run, read otherwise (CSV or SQLite).')
+    parser.add_argument('--design', type=FileType('r'),
+                        help='Experimental design (JSON, see `create_experiment.py`).')
+    parser.add_argument('--sampling', choices=sorted(SAMPLING), default='single-pass',
+                        help='How documents and sentences are sampled (default: single-pass).')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='Random seed (default: {0}).'.format(SEED))
+    parser.add_argument('--spam', action='append', choices=sorted(STRATEGIES), metavar='STRATEGY',
+                        help='Spam strategy, one of %(choices)s. Can be repeated (see '
+                             '`create_experiment.py`).')
+    parser.add_argument('-d', '--directory', default='output/html',
+                        help='Output directory for HTML (default: output/html).')
+    parser.add_argument('-p', '--page-size', type=int,
+                        help='Split HTML files into pages of this many items.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of HTML files written in parallel (default: number of CPUs).')
+    parser.add_argument('--sents', default='results/sentences/',
+                        help='Folder containing sentence-level results (default: results/sentences/).')
+    parser.add_argument('--docs', default='results/documents/',
+                        help='Folder containing document-level results (default: results/documents/).')
+    parser.add_argument('--index', default=':memory:',
+                        help='The ratings index (see `combine_results.py`, default: in memory).')
+    parser.add_argument('--results', help='Output of `combine_results` (CSV or SQLite).')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='Cache the output of each stage in DIR, and skip stages whose '
+                             'inputs, parameters and code have not changed.')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // 2**20, metavar='MB',
+                        help='Maximum size of the cache; least recently used outputs are '
+                             'removed first (default: %(default)s).')
+    parser.add_argument('--explain', action='store_true',
+                        help='Log why each stage was not taken from the cache.')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instruments = instrumentation.from_arguments(__file__, args)
+
+    try:
+        design = Design.from_json(args.design) if args.design else Design()
+        pipeline = Pipeline(src=args.src, systems=args.system,
+                            normalise=args.normalise or DEFAULT_RULES,
+                            design=design, sampling=args.sampling, seed=args.seed, spam=args.spam,
+                            directory=args.directory, page_size=args.page_size,
+                            jobs=args.jobs, ratings=find_ratings(args.sents, args.docs),
+                            index=args.index, data=args.data, items=args.items,
+                            results=args.results, explain=args.explain,
+                            cache=StageCache(args.cache, args.cache_size * 2**20) if args.cache else None,
+                            instruments=instruments)
+        pipeline.run(args.stages)
+        instruments.close(args.metrics)
+    except (ValueError, TypeError) as e:
+        parser.error(str(e))
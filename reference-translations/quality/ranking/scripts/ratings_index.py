@@ -0,0 +1,170 @@
+"""A persistent index of ratings, stored in SQLite.
+
+Ratings are read from CSV files with columns `ID` (e.g., `m1d-17`) and
+`Judgement` (`A`, `B` or `X`), one file per rater and level. The rater is
+identified by the file name without extension (e.g., `london`), so files of
+the same rater in different folders (e.g., one per level) must not rate the
+same items. Files are only read again if their size or modification time has
+changed and their content hash differs.
+"""
+
+import os
+import csv
+import sqlite3
+import hashlib
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    sha1 TEXT
+);
+CREATE TABLE IF NOT EXISTS ratings (
+    file_id TEXT,
+    file_order TEXT,
+    condition_st TEXT,
+    rater TEXT,
+    judgement TEXT,
+    path TEXT,
+    PRIMARY KEY (file_id, file_order, condition_st, rater)
+);
+CREATE INDEX IF NOT EXISTS ratings_path ON ratings (path);
+'''
+
+
+def parse_id(rating_id):
+    """Splits a rating id such as `m1d-17` into (condition_st, file_id,
+    file_order), e.g., ('m', '1d', '17')."""
+    file_id, file_order = rating_id.split('-')
+    return file_id[0], file_id[1:], file_order
+
+
+def ratings_files(paths):
+    """Expands directories in `paths` to the CSV files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.csv')))
+        else:
+            files.append(path)
+    return files
+
+
+def sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class RatingsIndex:
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.connection.execute('CREATE TEMP TABLE excluded '
+                                '(file_id TEXT, file_order TEXT, PRIMARY KEY (file_id, file_order))')
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, paths):
+        """Brings the index in line with the rating files in `paths`: new and
+        changed files are (re-)read, ratings from files that are no longer in
+        `paths` are removed. Returns the number of files read."""
+        paths = [os.path.abspath(p) for p in paths]
+        num_read = 0
+        with self.connection:
+            known = {row[0]: row[1:] for row in self.connection.execute(
+                'SELECT path, mtime, size, sha1 FROM files')}
+            for path in set(known) - set(paths):
+                self.remove(path)
+            for path in paths:
+                stat = os.stat(path)
+                if path in known:
+                    mtime, size, digest = known[path]
+                    if (mtime, size) == (stat.st_mtime, stat.st_size):
+                        continue
+                    new_digest = sha1(path)
+                    if new_digest == digest:
+                        self.connection.execute('UPDATE files SET mtime = ?, size = ? WHERE path = ?',
+                                                (stat.st_mtime, stat.st_size, path))
+                        continue
+                    self.remove(path)
+                else:
+                    new_digest = sha1(path)
+                self.add(path, stat, new_digest)
+                num_read += 1
+        return num_read
+
+    def add(self, path, stat, digest):
+        rater = os.path.splitext(os.path.basename(path))[0]
+        ratings = {} # (file_id, file_order, condition_st) => judgement; the last rating counts
+        with open(path) as f:
+            for r in csv.DictReader(f):
+                condition_st, file_id, file_order = parse_id(r['ID'])
+                ratings[(file_id, file_order, condition_st)] = r['Judgement']
+        try:
+            self.connection.executemany('INSERT INTO ratings VALUES (?, ?, ?, ?, ?, ?)',
+                                        [key + (rater, judgement, path)
+                                         for key, judgement in ratings.items()])
+        except sqlite3.IntegrityError:
+            for (file_id, file_order, condition_st) in ratings:
+                other = self.connection.execute(
+                    'SELECT path FROM ratings WHERE file_id = ? AND file_order = ? '
+                    'AND condition_st = ? AND rater = ? AND path != ?',
+                    (file_id, file_order, condition_st, rater, path)).fetchone()
+                if other:
+                    raise ValueError('{0} and {1} both contain ratings of {2}{3}-{4} by {5}.'.format(
+                        other[0], path, condition_st, file_id, file_order, rater))
+            raise
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                (path, stat.st_mtime, stat.st_size, digest))
+
+    def remove(self, path):
+        self.connection.execute('DELETE FROM ratings WHERE path = ?', (path,))
+        self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def ratings(self):
+        """Yields (file_id, file_order, condition_st, rater, judgement) for all
+        ratings, ordered by rater within each item."""
+        yield from self.connection.execute(
+            'SELECT file_id, file_order, condition_st, rater, judgement FROM ratings '
+            'ORDER BY file_id, file_order, condition_st, rater')
+
+    def max_raters(self):
+        """The largest number of raters of any item and condition."""
+        row = self.connection.execute(
+            'SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM ratings '
+            'GROUP BY file_id, file_order, condition_st)').fetchone()
+        return row[0] or 0
+
+    def exclude(self, keys):
+        """Excludes items, given as (file_id, file_order), from
+        `judgement_counts()` and `pair_counts()`."""
+        with self.connection:
+            self.connection.execute('DELETE FROM excluded')
+            self.connection.executemany('INSERT OR IGNORE INTO excluded VALUES (?, ?)', keys)
+
+    def judgement_counts(self):
+        """Yields (condition_st, file_id, file_order, judgement, count): how
+        many raters chose each judgement for each item."""
+        yield from self.connection.execute(
+            'SELECT condition_st, file_id, file_order, judgement, COUNT(*) FROM ratings r '
+            'WHERE NOT EXISTS (SELECT 1 FROM excluded e '
+            'WHERE e.file_id = r.file_id AND e.file_order = r.file_order) '
+            'GROUP BY condition_st, file_id, file_order, judgement '
+            'ORDER BY condition_st, file_id, file_order, judgement')
+
+    def pair_counts(self):
+        """Yields (condition_st, level, rater_1, rater_2, judgement_1,
+        judgement_2, count): a contingency table for each pair of raters who
+        rated the same items."""
+        yield from self.connection.execute(
+            'SELECT r1.condition_st, SUBSTR(r1.file_id, -1), r1.rater, r2.rater, '
+            'r1.judgement, r2.judgement, COUNT(*) FROM ratings r1 JOIN ratings r2 '
+            'ON r1.file_id = r2.file_id AND r1.file_order = r2.file_order '
+            'AND r1.condition_st = r2.condition_st AND r1.rater < r2.rater '
+            'WHERE NOT EXISTS (SELECT 1 FROM excluded e '
+            'WHERE e.file_id = r1.file_id AND e.file_order = r1.file_order) '
+            'GROUP BY 1, 2, 3, 4, 5, 6 ORDER BY 1, 2, 3, 4, 5, 6')
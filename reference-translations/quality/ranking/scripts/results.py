@@ -1,56 +1,182 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import csv
+import json
+from contextlib import redirect_stdout
 from collections import defaultdict
 from argparse import ArgumentParser, FileType
+from concurrent.futures import ProcessPoolExecutor
+
+from tables import read_table, CountingStream
+from store import is_store, open_store
+from ratings_index import parse_id, ratings_files
+import instrumentation
 
 
 VALID_RATINGS = ['A', 'B', 'X']
 
+items = {} # file_id => (file_id, file_order) => (task_id, A_origin, B_origin); set per process
+
+
+def read_items(path):
+    """Reads the original items into an index."""
+    return {(item['file_id'], item['file_order']): (item['task_id'], item['A_origin'], item['B_origin'])
+            for item in read_table(path)}
+
+
+def group_items(items):
+    """Groups the index of `read_items` by file, so that each rater's
+    ratings are only compared with the items of their own files."""
+    files = defaultdict(dict)
+    for key, item in items.items():
+        files[key[0]][key] = item
+    return dict(files)
 
-parser = ArgumentParser(description='Aggregates ratings from a results file.'
-                                    'Also checks spam items.')
-parser.add_argument('items', type=FileType('r'), help='The original items (`items.csv`).')
-parser.add_argument('ratings', type=FileType('r'), help='The ratings (CSV).')
 
-args = parser.parse_args()
+def set_items(the_items):
+    global items
+    items = the_items
 
 
-# read rater's ratings
-ratings = defaultdict(dict) # task_id => task_order => rating
-for r in csv.DictReader(args.ratings):
-    file_id, task_order = r['ID'].split('-')
-    condition_st, file_id, level = file_id[0], file_id[1:], file_id[2]
-    rating = r['Judgement']
-    ratings[file_id][task_order] = rating
+def read_ratings(ratings_file):
+    """Yields (condition_st, file_id, file_order, judgement) for each rating
+    in a rater's spreadsheet."""
+    with open(ratings_file) as f:
+        for r in csv.DictReader(f):
+            yield parse_id(r['ID']) + (r['Judgement'],)
 
-# evaluate ratings
-results = defaultdict(lambda: defaultdict(int))
-results_spam = []
-for item in csv.DictReader(args.items):
-    if item['file_id'] in ratings:
-        is_spam = 'spam' in [item['A_origin'], item['B_origin']]
-        rating = ratings[item['file_id']][item['file_order']]
-        origin = item[rating  + '_origin'] if rating != 'X' else 'tie'
+
+def evaluate(ratings_file, the_ratings=None):
+    """Aggregates the ratings in `ratings_file`, or `the_ratings` (as
+    returned by `read_ratings`) if given, and checks spam items."""
+    # read rater's ratings
+    ratings = {} # (file_id, file_order) => rating
+    conditions = set()
+    levels = set()
+    if the_ratings is None:
+        the_ratings = read_ratings(ratings_file)
+    for condition_st, file_id, file_order, judgement in the_ratings:
+        ratings[(file_id, file_order)] = judgement
+        conditions.add(condition_st)
+        levels.add(file_id[-1])
+    # evaluate ratings
+    results = defaultdict(lambda: defaultdict(int))
+    results_spam = []
+    unrated = []
+    rated_file_ids = set(file_id for file_id, _ in ratings)
+    rated_items = [(key, item) for file_id, file_items in items.items()
+                   if file_id in rated_file_ids for key, item in file_items.items()]
+    for key, (task_id, A_origin, B_origin) in rated_items:
+        if key not in ratings:
+            unrated.append('-'.join(key))
+            continue
+        is_spam = 'spam' in [A_origin, B_origin]
+        rating = ratings[key]
+        origin = {'A': A_origin, 'B': B_origin}[rating] if rating != 'X' else 'tie'
         if is_spam:
-            segment_id = item['file_id'] + '-' + item['file_order']
+            segment_id = '-'.join(key)
             results_spam.append(segment_id if origin == 'spam' else False)
         if not is_spam:
-            results[item['task_id']][origin] += 1
-
-print("{0} {1} ratings for:".format('Monolingual' if condition_st == 'm' else 'Bilingual',
-                                'document-level' if level == 'd' else 'sentence-level'))
-
-for task_id, ratings in results.items():
-    print("\ntask `{0}`:".format(task_id))
-    total = 0
-    for origin, count in ratings.items():
-        print("\t{0}\t{1}".format(count, origin))
-        total += count
-    print("\t--")
-    print("\t{0}\ttotal".format(total))
-
-missed_spam = sum([1 for r in results_spam if r != False])
-print("\nMissed spam: {0}/{1}".format(missed_spam, len(results_spam)))
-if missed_spam > 0:
-    print("Missed spam item ids: {0}".format(', '.join([i for i in results_spam if i])))
+            results[task_id][origin] += 1
+    return {
+        'ratings': ratings_file,
+        'condition': ''.join(sorted(conditions)),
+        'level': ''.join(sorted(levels)),
+        'tasks': {task_id: dict(counts) for task_id, counts in results.items()},
+        'spam': len(results_spam),
+        'missed_spam': [i for i in results_spam if i],
+        'unrated': unrated,
+    }
+
+
+def print_report(report):
+    condition_st, level = report['condition'], report['level']
+    print("{0} {1} ratings for:".format('Monolingual' if condition_st == 'm' else 'Bilingual',
+                                    'document-level' if level == 'd' else 'sentence-level'))
+
+    for task_id, ratings in report['tasks'].items():
+        print("\ntask `{0}`:".format(task_id))
+        total = 0
+        for origin, count in ratings.items():
+            print("\t{0}\t{1}".format(count, origin))
+            total += count
+        print("\t--")
+        print("\t{0}\ttotal".format(total))
+
+    missed_spam = report['missed_spam']
+    print("\nMissed spam: {0}/{1}".format(len(missed_spam), report['spam']))
+    if len(missed_spam) > 0:
+        print("Missed spam item ids: {0}".format(', '.join(missed_spam)))
+    if report['unrated']:
+        print("Unrated item ids: {0}".format(', '.join(report['unrated'])))
+
+
+def find_ratings(paths):
+    """Expands directories in `paths` to the CSV files they contain, and
+    stores to the ratings of each rater and level. Returns a list of (name,
+    ratings), where ratings are None for files."""
+    found = []
+    for path in paths:
+        if is_store(path):
+            store, study = open_store(path)
+            raters = defaultdict(list) # (rater, level) => ratings
+            for file_id, file_order, condition_st, rater, judgement in store.rating_tuples(study):
+                raters[(rater, file_id[-1])].append((condition_st, file_id, file_order, judgement))
+            found.extend(('{0}#{1}.{2}'.format(path, rater, level), ratings)
+                         for (rater, level), ratings in sorted(raters.items()))
+        else:
+            found.extend((f, None) for f in ratings_files([path]))
+    return found
+
+
+if __name__ == '__main__': # worker processes import this module
+    parser = ArgumentParser(description='Aggregates ratings from a results file.'
+                                        'Also checks spam items.')
+    parser.add_argument('items', help='The original items (`items.csv`, or a store; see '
+                                      '`store.py`).')
+    parser.add_argument('ratings', nargs='+', help='The ratings (CSV), folders '
+                                                   'containing ratings files, or stores.')
+    parser.add_argument('--json', type=FileType('w'), nargs='?', const=sys.stdout,
+                        help='Write a JSON report for all ratings files (to stdout '
+                             'if no file is given) instead of text.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of ratings files evaluated in parallel '
+                             '(default: number of CPUs).')
+    instrumentation.add_arguments(parser)
+
+    args = parser.parse_args()
+    instruments = instrumentation.from_arguments(__file__, args)
+
+    try: # items and ratings of several studies in a store must not be mixed
+        ratings = find_ratings(args.ratings)
+        with instruments.stage('read_items') as stage:
+            set_items(group_items(read_items(args.items)))
+            stage.rows = sum(len(file_items) for file_items in items.values())
+    except ValueError as e:
+        parser.error(str(e))
+    with instruments.stage('evaluate') as stage:
+        if args.jobs > 1 and len(ratings) > 1:
+            with ProcessPoolExecutor(max_workers=min(args.jobs, len(ratings)),
+                                     initializer=set_items, initargs=(items,)) as executor:
+                reports = list(executor.map(evaluate, *zip(*ratings)))
+        else:
+            reports = [evaluate(*r) for r in ratings]
+        stage.rows = sum(sum(counts.values()) for report in reports
+                         for counts in report['tasks'].values())
+
+    with instruments.stage('report') as stage:
+        out = CountingStream(args.json or sys.stdout)
+        if args.json:
+            json.dump(reports, out, indent=2)
+            out.write('\n')
+        else:
+            with redirect_stdout(out):
+                for i, report in enumerate(reports):
+                    if len(reports) > 1:
+                        print("{0}==> {1} <==".format('\n' if i else '', report['ratings']))
+                    print_report(report)
+        stage.rows = len(reports)
+        stage.bytes_written = out.count
+    instruments.close(args.metrics)
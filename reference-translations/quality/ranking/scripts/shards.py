@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""Creates experiments for several testsets (language pairs, WMT years) at
+once, listed in a JSON manifest:
+
+    [
+      {
+        "name": "wmt17-zhen",
+        "src": "input/newstest2017-zhen-src.zh.sgm",
+        "origlang": "zh",
+        "systems": {"mt": "input/microsoft-mt-combo6.txt",
+                    "human_a": "input/microsoft-ht.txt",
+                    "human_b": "input/graham-ht.csv"},
+        "sampling": "rejection",
+        "seed": 80469
+      }
+    ]
+
+Only `name`, `src` and `systems` are required. `origlang` (default: zh, or
+`null` for all articles),
+`normalise` (a list of rules), `design` (see `design.py`), `sampling`, `spam`
+(a list of strategies) and `seed` work as in `combine_data.py` and
+`create_experiment.py`. If no seed is
+given, it is derived from the name of the testset, so that each testset is
+sampled independently of the others.
+
+For each testset, `data.csv`, `items.csv` and HTML are written to a directory
+of the same name. Each testset is split into `--shards` ranges of articles,
+which are combined in parallel and merged in order. Where each article starts
+in the testset and its translations is indexed once, so that each shard
+reads only its own articles, and document-level translations are read once
+and passed to all processes. Sampling runs in
+parallel for different testsets. Combining involves no randomness and seeds
+do not depend on the number of processes, so the output is the same as with
+`--jobs 1` (and as with `combine_data.py` and `create_experiment.py`).
+"""
+
+import os
+import json
+import logging
+from argparse import ArgumentParser, FileType
+from concurrent.futures import ProcessPoolExecutor
+
+from tables import write_table
+from aligner import read_spreadsheet
+from normalisation import DEFAULT_RULES
+from combine_data import combine, index_articles, fieldnames
+from create_experiment import create_experiment, FIELDNAMES, SEED
+from create_html import create_html
+from design import Design
+
+
+SHARDS_PER_JOB = 4
+
+
+class Testset:
+    """A testset from the manifest."""
+
+    def __init__(self, name, src, systems, origlang='zh', normalise=DEFAULT_RULES,
+                 design=None, sampling='single-pass', spam=None, seed=None):
+        self.name = name
+        self.src = src
+        self.systems = list(systems.items())
+        self.origlang = origlang
+        self.normalise = normalise
+        self.design = Design(**(design or {}))
+        self.sampling = sampling
+        self.spam = spam
+        self.seed = '{0}-{1}'.format(SEED, name) if seed is None else seed
+
+
+def read_manifest(f):
+    testsets = [Testset(**spec) for spec in json.load(f)]
+    names = [testset.name for testset in testsets]
+    if len(set(names)) != len(names):
+        raise ValueError('Testset names must be unique: ' + ', '.join(names))
+    return testsets
+
+
+aligners = {} # testset name => dict of name => document-level translation
+
+
+def read_aligners(testsets):
+    """Reads the document-level translations of all `testsets`."""
+    return {testset.name: {name: read_spreadsheet(path, name)
+                           for name, path in testset.systems if path.endswith('.csv')}
+            for testset in testsets}
+
+
+def set_aligners(the_aligners):
+    global aligners
+    aligners = the_aligners
+
+
+def combine_shard(testset, articles, start):
+    """Returns the rows of `combine_data.py` for the articles at positions
+    `articles` of `testset`, which start at `start` (see `index_articles`)."""
+    return list(combine(testset.src, testset.systems, testset.normalise,
+                        testset.origlang, articles, aligners[testset.name], start))
+
+
+def sample(testset, rows):
+    items = create_experiment(rows, testset.design, testset.sampling, testset.seed, testset.spam)
+    return [item.as_row() for item in items]
+
+
+def shards(testsets, num_shards):
+    """Yields (testset index, range of articles, where the first article
+    starts) for all testsets, splitting each into `num_shards` ranges of
+    about the same size."""
+    for i, testset in enumerate(testsets):
+        index = index_articles(testset.src, testset.systems)
+        bounds = [len(index) * s // num_shards for s in range(num_shards + 1)]
+        for start, stop in zip(bounds, bounds[1:]):
+            if start < stop:
+                yield i, range(start, stop), index[start]
+
+
+def run(testsets, directory, num_shards=None, page_size=None, jobs=1):
+    """Combines, samples and writes HTML for all `testsets`, in `jobs`
+    processes. By default, each testset is split into `SHARDS_PER_JOB`
+    shards per process."""
+    work = list(shards(testsets, num_shards or SHARDS_PER_JOB * jobs))
+    set_aligners(read_aligners(testsets))
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=set_aligners,
+                                   initargs=(aligners,)) if jobs > 1 else None
+    map_ = executor.map if executor else map
+    try:
+        # combine shards, and merge them in order
+        data = [[] for _ in testsets]
+        combined = map_(combine_shard, [testsets[i] for i, _, _ in work],
+                        [a for _, a, _ in work], [start for _, _, start in work])
+        for (i, _, _), rows in zip(work, combined):
+            data[i].extend(rows)
+        logging.info('Combined %s testsets in %s shards.', len(testsets), len(work))
+        # sample each testset
+        items = list(map_(sample, testsets, data))
+    finally:
+        if executor:
+            executor.shutdown()
+
+    for testset, rows, testset_items in zip(testsets, data, items):
+        testset_directory = os.path.join(directory, testset.name)
+        os.makedirs(os.path.join(testset_directory, 'html'), exist_ok=True)
+        write_table(os.path.join(testset_directory, 'data.csv'), fieldnames(testset.systems), rows)
+        write_table(os.path.join(testset_directory, 'items.csv'), FIELDNAMES, testset_items)
+        create_html(testset_items, os.path.join(testset_directory, 'html'), page_size, jobs)
+        logging.info('Testset %s: %s rows, %s items.', testset.name, len(rows), len(testset_items))
+
+
+if __name__ == '__main__': # worker processes import this module
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = ArgumentParser(description='Creates experiments for all testsets in a manifest, '
+                                        'in parallel.')
+    parser.add_argument('manifest', type=FileType('r'), help='The testsets (JSON).')
+    parser.add_argument('-o', '--output', default='output/testsets',
+                        help='Output directory, with one subdirectory per testset '
+                             '(default: output/testsets).')
+    parser.add_argument('--shards', type=int,
+                        help='Number of shards per testset (default: {0} per process).'.format(
+                            SHARDS_PER_JOB))
+    parser.add_argument('-p', '--page-size', type=int,
+                        help='Split HTML files into pages of this many items.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of processes (default: number of CPUs).')
+    args = parser.parse_args()
+    if args.shards is not None and args.shards < 1:
+        parser.error('There must be at least one shard.')
+
+    try:
+        testsets = read_manifest(args.manifest)
+    except (ValueError, TypeError) as e:
+        parser.error('Invalid manifest: {0}'.format(e))
+    run(testsets, args.output, args.shards, args.page_size, args.jobs)
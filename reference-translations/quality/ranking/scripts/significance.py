@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""Tests whether raters prefer one origin over the other in the
+output of `combine_results.py` (`results.csv`).
+
+For each level (sentence, document), rating (fluency, adequacy) and
+pair of origins compared, reports the share of non-tie judgements in
+favour of the first origin with a bootstrap confidence interval, an
+exact sign test, and a sign-flip permutation test. Bootstrap and
+permutation resample documents (`wmt_article`) rather than single
+judgements, since judgements of sentences from the same document are
+not independent. Resampling runs in a process pool; results only
+depend on the seed, not on the number of processes.
+
+Output is written to STDOUT as CSV.
+"""
+
+import os
+import re
+import sys
+import csv
+import math
+import random
+from collections import defaultdict
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from tables import read_table
+from create_experiment import SEED
+
+
+RATER_FIELD = re.compile(r'^(fluency|adequacy)_rater\d+$')
+CHUNK_SIZE = 1000 # resamples per task
+
+
+def collect(results_file):
+    """Returns a dict of (level, rating, origin_1, origin_2) => document =>
+    [wins of origin_1, wins of origin_2, ties]. Spam items are ignored."""
+    counts = defaultdict(lambda: defaultdict(lambda: [0, 0, 0]))
+    for item in read_table(results_file):
+        origins = sorted([item['A_origin'], item['B_origin']])
+        if 'spam' in origins:
+            continue
+        for field, origin in item.items():
+            match = RATER_FIELD.match(field)
+            if not match or not origin:
+                continue
+            key = (item['level'], match.group(1), origins[0], origins[1])
+            document = counts[key][item['wmt_article']]
+            if origin == 'tie':
+                document[2] += 1
+            else:
+                document[origins.index(origin)] += 1
+    return counts
+
+
+def sign_test(wins, losses):
+    """Two-sided exact binomial test of wins vs. losses with p = 0.5."""
+    n = wins + losses
+    if n == 0:
+        return 1.0
+    k = min(wins, losses)
+    tail = sum(math.comb(n, i) for i in range(k + 1)) / 2 ** n
+    return min(1.0, 2 * tail)
+
+
+def resample(task):
+    """Runs one chunk of bootstrap and permutation resamples. Returns the
+    bootstrap shares and the number of permutations at least as extreme as
+    the observed difference."""
+    seed, key, chunk, num_resamples, wins, losses = task
+    rng = random.Random('{0}-{1}-{2}'.format(seed, '-'.join(key), chunk))
+    n = len(wins)
+    indices = range(n)
+    differences = [w - l for w, l in zip(wins, losses)]
+    observed = abs(sum(differences))
+    shares = []
+    extreme = 0
+    for _ in range(num_resamples):
+        # bootstrap: draw documents with replacement
+        sample = rng.choices(indices, k=n)
+        total_wins = sum(wins[i] for i in sample)
+        total = total_wins + sum(losses[i] for i in sample)
+        shares.append(total_wins / total if total else 0.5)
+        # permutation: flip the sign of each document's difference at random
+        signs = rng.getrandbits(n) if n else 0
+        statistic = sum(d if signs >> i & 1 else -d for i, d in enumerate(differences))
+        extreme += abs(statistic) >= observed
+    return shares, extreme
+
+
+def percentile(sorted_values, q):
+    """Linear interpolation between closest ranks (as numpy's default)."""
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+if __name__ == '__main__': # worker processes import this module
+    parser = ArgumentParser(description='Tests the significance of preferences in the '
+                                        'output of `combine_results.py`.')
+    parser.add_argument('results', nargs='?', default='results.csv',
+                        help='The combined results (default: results.csv).')
+    parser.add_argument('-n', '--resamples', type=int, default=10000,
+                        help='Number of bootstrap and permutation resamples (default: 10000).')
+    parser.add_argument('-c', '--confidence', type=float, default=0.95,
+                        help='Confidence level of bootstrap intervals (default: 0.95).')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='Random seed (default: {0}).'.format(SEED))
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of processes (default: number of CPUs).')
+    args = parser.parse_args()
+
+    counts = collect(args.results)
+    keys = sorted(counts)
+    tasks = []
+    for key in keys:
+        documents = sorted(counts[key])
+        wins = [counts[key][d][0] for d in documents]
+        losses = [counts[key][d][1] for d in documents]
+        for chunk, start in enumerate(range(0, args.resamples, CHUNK_SIZE)):
+            tasks.append((args.seed, key, chunk, min(CHUNK_SIZE, args.resamples - start), wins, losses))
+    if args.jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            resampled = list(executor.map(resample, tasks, chunksize=max(1, len(tasks) // (4 * args.jobs))))
+    else:
+        resampled = [resample(task) for task in tasks]
+
+    shares = defaultdict(list)
+    extreme = defaultdict(int)
+    for task, (chunk_shares, chunk_extreme) in zip(tasks, resampled):
+        shares[task[1]].extend(chunk_shares)
+        extreme[task[1]] += chunk_extreme
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['level', 'rating', 'origin_1', 'origin_2', 'documents',
+                     'wins_1', 'wins_2', 'ties', 'share_1', 'ci_low', 'ci_high',
+                     'p_sign', 'p_permutation'])
+    alpha = (1 - args.confidence) / 2
+    for key in keys:
+        wins, losses, ties = [sum(c[i] for c in counts[key].values()) for i in range(3)]
+        key_shares = sorted(shares[key])
+        writer.writerow(list(key) + [
+            len(counts[key]), wins, losses, ties,
+            '{0:.4f}'.format(wins / (wins + losses) if wins + losses else 0.5),
+            '{0:.4f}'.format(percentile(key_shares, alpha)) if key_shares else '',
+            '{0:.4f}'.format(percentile(key_shares, 1 - alpha)) if key_shares else '',
+            '{0:.4g}'.format(sign_test(wins, losses)),
+            # add one to avoid p = 0 (Phipson and Smyth, 2010)
+            '{0:.4g}'.format((extreme[key] + 1) / (args.resamples + 1)),
+        ])
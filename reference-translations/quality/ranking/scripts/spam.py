@@ -0,0 +1,113 @@
+"""Spam items (attention checks): translations that raters should never
+prefer.
+
+The spam text of a column is taken from a `TokenPool`, which tokenises each
+sentence or article of the column the first time it is used as a spam
+source, so that only spam sources are tokenised; a source is then a range of
+token indexes, and a spam text is an array of token indexes that is only
+joined into a string when it is written. Strategies turn the tokens of a
+source into spam:
+
+* `shuffled`: the middle 80% of tokens in random order (as in `items.csv`).
+* `truncated`: only the first 30 to 60% of tokens.
+* `duplicated`: a fifth of the tokens is repeated.
+* `swapped-source`: the tokens of another source.
+
+Further strategies can be added with `register_strategy()`.
+"""
+
+from array import array
+
+from corpus import TokenSequence, token
+
+
+STRATEGIES = {}
+DEFAULT_STRATEGIES = ['shuffled']
+
+
+def register_strategy(name, strategy):
+    """Adds a strategy, a function (pool, span, others, rng) that returns the
+    token indexes of a spam text, as an array. `span` is the range of token
+    indexes of the source, `others` the spans of all sources of the same
+    level, and `rng` a `random.Random` (or the `random` module)."""
+    STRATEGIES[name] = strategy
+
+
+class TokenPool:
+    """Whitespace-separated tokens of one column of a corpus, found when a
+    sentence or article is first used."""
+
+    def __init__(self, corpus, column):
+        self.column = column
+        self.buffer = corpus.buffers[column]
+        self.starts, self.ends = array('q'), array('q')
+        self.spans = {} # (first, last) sentence of a view => range of token indexes
+
+    def span(self, view):
+        """Token indexes of a sentence or article, as a range."""
+        key = view.first, view.last
+        if key not in self.spans:
+            start, end = view.span(self.column)
+            first = len(self.starts)
+            for match in token.finditer(self.buffer, start, end):
+                self.starts.append(match.start())
+                self.ends.append(match.end())
+            self.spans[key] = range(first, len(self.starts))
+        return self.spans[key]
+
+    def sequence(self, order):
+        return TokenSequence(self.buffer, self.starts, self.ends, order)
+
+
+def shuffled(pool, span, others, rng):
+    n = len(span)
+    d = n//10 # leave the first and last 10% of tokens untouched
+    rest = list(span[d:n-d])
+    rng.shuffle(rest) # shuffle the remaining tokens randomly
+    order = array('q', span[:d])
+    order.extend(rest)
+    order.extend(span[n-d:])
+    return order
+
+
+def truncated(pool, span, others, rng):
+    n = len(span)
+    return array('q', span[:max(1, int(n * rng.uniform(0.3, 0.6)))])
+
+
+def duplicated(pool, span, others, rng):
+    n = len(span)
+    m = max(1, n//5)
+    start = rng.randrange(0, max(1, n - m + 1))
+    order = array('q', span[:start + m])
+    order.extend(span[start:start + m])
+    order.extend(span[start + m:])
+    return order
+
+
+def swapped_source(pool, span, others, rng):
+    candidates = [other for other in others if other != span and len(other)]
+    return array('q', rng.choice(candidates) if candidates else span)
+
+
+register_strategy('shuffled', shuffled)
+register_strategy('truncated', truncated)
+register_strategy('duplicated', duplicated)
+register_strategy('swapped-source', swapped_source)
+
+
+def make_spam(pool, view, rng, strategy='shuffled', others=()):
+    """Returns the spam text of a single sentence or article."""
+    return pool.sequence(STRATEGIES[strategy](pool, pool.span(view), others, rng))
+
+
+def make_spam_batch(pool, views, strategies, rng):
+    """Returns spam texts for all `views` (sentences or articles of one level)
+    in one pass, using `strategies` in turn."""
+    unknown = [s for s in strategies if s not in STRATEGIES]
+    if unknown:
+        raise ValueError('Unknown spam strategy(s): ' + ', '.join(unknown))
+    spans = [pool.span(view) for view in views]
+    functions = [STRATEGIES[s] for s in strategies]
+    return [pool.sequence(functions[i % len(functions)](pool, span, spans, rng))
+            for i, span in enumerate(spans)]
@@ -0,0 +1,151 @@
+"""A content-addressed cache for the stages run by `pipeline.py`.
+
+Each stage is identified by a fingerprint: a hash over its parameters
+(including the random seed), the content of its input files, the code it
+runs, and the fingerprint of the stage it reads from. The output of a stage
+is stored under its fingerprint, so a stage whose fingerprint has been seen
+before is not run again. Entries that have not been used for the longest
+time are evicted once the cache exceeds its maximum size.
+"""
+
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import tempfile
+
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024 # bytes
+MANIFEST = 'manifest.json'
+PAYLOAD = 'payload.pickle'
+FILES = 'files'
+
+
+def sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest(stage, params=None, inputs=(), code=(), upstream=None):
+    """Describes what a stage depends on. `inputs` and `code` are file paths,
+    which are hashed by content; `upstream` is the fingerprint of the stage
+    whose output is used. Values are passed through JSON, so that manifests
+    compare equal to ones read back from the cache."""
+    return json.loads(json.dumps({
+        'stage': stage,
+        'params': params or {},
+        'inputs': {path: sha1(path) for path in inputs},
+        'code': {os.path.basename(path): sha1(path) for path in code},
+        'upstream': upstream,
+    }))
+
+
+def fingerprint(manifest):
+    serialised = json.dumps(manifest, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(serialised).hexdigest()
+
+
+def explain(old, new):
+    """Lists the differences between two manifests of a stage."""
+    if old is None:
+        return ['stage has not been run with this cache before']
+    reasons = []
+    for key in sorted(set(old['params']) | set(new['params'])):
+        before, after = old['params'].get(key), new['params'].get(key)
+        if before != after:
+            reasons.append('parameter {0} changed: {1!r} -> {2!r}'.format(key, before, after))
+    for kind, label in (('inputs', 'input file'), ('code', 'code')):
+        for path in sorted(set(old[kind]) | set(new[kind])):
+            if path not in old[kind]:
+                reasons.append('{0} {1} added'.format(label, path))
+            elif path not in new[kind]:
+                reasons.append('{0} {1} removed'.format(label, path))
+            elif old[kind][path] != new[kind][path]:
+                reasons.append('{0} {1} changed'.format(label, path))
+    if old['upstream'] != new['upstream']:
+        reasons.append('output of previous stage changed')
+    return reasons or ['cached output was evicted']
+
+
+class StageCache:
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def _last(self, stage):
+        return os.path.join(self.directory, 'last-{0}.json'.format(stage))
+
+    def last_manifest(self, stage):
+        """Returns the manifest of the last run of `stage`, if any."""
+        try:
+            with open(self._last(stage)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def get(self, key):
+        """Returns (payload, directory of stored files) for `key`, or None if
+        it is not cached."""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, PAYLOAD), 'rb') as f:
+                payload = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        os.utime(entry) # marks the entry as recently used
+        return payload, os.path.join(entry, FILES)
+
+    def put(self, key, manifest, payload, files=()):
+        """Stores `payload` and copies of `files` under `key`."""
+        staging = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        os.mkdir(os.path.join(staging, FILES))
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f, sort_keys=True, indent=1)
+        with open(os.path.join(staging, PAYLOAD), 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for path in files:
+            shutil.copy2(path, os.path.join(staging, FILES))
+        entry = self._entry(key)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry)
+        self.evict(keep=key)
+
+    def record(self, manifest):
+        """Remembers `manifest` as the last run of its stage."""
+        with open(self._last(manifest['stage']), 'w') as f:
+            json.dump(manifest, f, sort_keys=True, indent=1)
+
+    def entries(self):
+        """Yields (last use, size, key) of each cached entry."""
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(entry) for name in names)
+            yield os.stat(entry).st_mtime, size, key
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries (other than `keep`) until
+        the cache fits into its maximum size. Returns the evicted keys."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted
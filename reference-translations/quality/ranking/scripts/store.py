@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+
+"""A compact binary store of items, ratings and error annotations of any
+number of studies.
+
+A store is a directory with one file per column and a `meta.json` that
+describes them. Columns are arrays of fixed-size integers that are
+memory-mapped when accessed, so opening a store does not read any data:
+
+* categorical columns (origins, task and file ids, raters, judgements, ...)
+  hold codes into a dictionary listed in `meta.json`; dictionaries such as
+  `origin` are shared by all columns and tables that use them. Each
+  categorical column has an index (the rows of each code), so that rows
+  can be selected by value without a scan.
+* integer columns hold numbers (`file_order`, `wmt_article`, ...).
+* text columns (`src`, `A`, `B`, `wmt_line`) are UTF-8 strings stored one
+  after another, with the offset of each.
+* error annotations (`error-analysis/results.csv`) are a bit matrix, one
+  bit per category, packed into bytes for each row.
+
+Tables are `items` (as in `items.csv`, plus `study` and `level`), `ratings`
+(one row per rater, item and condition; `item` is a row of `items`) and
+`errors` (one row per annotated example; `origin` is resolved from the
+items of the error analysis).
+
+Stores are built from a JSON manifest of studies:
+
+    [
+      {
+        "name": "wmt17-zhen",
+        "items": "items.csv",
+        "ratings": ["results/sentences", "results/documents"],
+        "errors": "../error-analysis/results.csv",
+        "error_items": "../error-analysis/items.csv"
+      }
+    ]
+
+`ratings`, `errors` and `error_items` are optional.
+
+Scripts that read items with `tables.read_table` accept a store instead of
+`items.csv`, as `results.store#wmt17-zhen`. Ids of items and ratings are
+only unique within a study, so the study can only be left out if the store
+holds a single one (`results.store`). `results.py` and
+`combine_results.py` then also read ratings from the store, and
+`error-analysis/analysis.py --store` reads error annotations.
+"""
+
+import os
+import sys
+import csv
+import json
+import mmap
+import logging
+from array import array
+from argparse import ArgumentParser, FileType
+
+from tables import read_table
+from ratings_index import RatingsIndex, ratings_files
+
+
+META = 'meta.json'
+VERSION = 1
+ITEM_FIELDS = ['file_id', 'file_order', 'task_id', 'task_order', 'wmt_article', 'wmt_line',
+               'src', 'A', 'B', 'A_origin', 'B_origin']
+SCHEMA = { # table => [(column, kind, dictionary)]
+    'items': [
+        ('study', 'code', 'study'),
+        ('file_id', 'code', 'file_id'),
+        ('file_order', 'int', None),
+        ('task_id', 'code', 'task_id'),
+        ('task_order', 'int', None),
+        ('level', 'code', 'level'),
+        ('wmt_article', 'int', None),
+        ('wmt_line', 'text', None),
+        ('src', 'text', None),
+        ('A', 'text', None),
+        ('B', 'text', None),
+        ('A_origin', 'code', 'origin'),
+        ('B_origin', 'code', 'origin'),
+    ],
+    'ratings': [
+        ('study', 'code', 'study'),
+        ('item', 'int', None),
+        ('condition', 'code', 'condition'),
+        ('rater', 'code', 'rater'),
+        ('judgement', 'code', 'judgement'),
+    ],
+    'errors': [
+        ('study', 'code', 'study'),
+        ('item', 'int', None),
+        ('example', 'code', 'example'),
+        ('origin', 'code', 'origin'),
+    ],
+}
+LEVELS = {'d': 'document', 's': 'sentence'}
+NON_CATEGORIES = ['Item', 'Example', 'Notes'] # columns of error annotations
+
+
+def error_origins(items):
+    """Maps (item_id, example) to the origin of each example in `items` (rows
+    of `error-analysis/items.csv`)."""
+    origins = {}
+    for item in items:
+        for column, value in item.items():
+            if column.endswith('_origin'):
+                origins[(item['item_id'], column[:-len('_origin')])] = value
+    return origins
+
+
+def is_store(path):
+    """Whether `path` is a store, optionally followed by `#study`."""
+    return os.path.isfile(os.path.join(path.partition('#')[0], META))
+
+
+def open_store(path, all_studies=False):
+    """Opens a store given as `directory` or `directory#study`. Returns
+    the store and the study. If no study is given, the store must hold a
+    single one, unless `all_studies` is set (the study is then None)."""
+    directory, _, study = path.partition('#')
+    store = Store(directory)
+    if study:
+        if study not in store.studies:
+            raise ValueError('Unknown study {0} in {1}.'.format(study, directory))
+        return store, study
+    if all_studies:
+        return store, None
+    if len(store.studies) > 1:
+        raise ValueError('{0} holds several studies ({1}); select one as {0}#STUDY.'.format(
+            directory, ', '.join(store.studies)))
+    return store, store.studies[0] if store.studies else None
+
+
+def typecode(maximum):
+    """The smallest unsigned array type for values up to `maximum`."""
+    for code in 'BHIQ':
+        if maximum < 2 ** (8 * array(code).itemsize):
+            return code
+
+
+class Dictionary:
+    """Maps values of a categorical column to codes, in order of appearance."""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value):
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+
+class StoreWriter:
+    """Collects studies in memory, and writes them to `directory` on `close()`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.dictionaries = {}
+        self.columns = {table: {column: [] for column, _, _ in columns}
+                        for table, columns in SCHEMA.items()}
+        self.flags = bytearray()
+        self.categories = None
+        self.item_rows = {} # (study, file_id, file_order) => row of items
+
+    def dictionary(self, name):
+        return self.dictionaries.setdefault(name, Dictionary())
+
+    def append(self, table, row):
+        for column, kind, dictionary in SCHEMA[table]:
+            value = row[column]
+            if kind == 'code':
+                value = self.dictionary(dictionary).encode(value)
+            elif kind == 'int':
+                value = int(value)
+            self.columns[table][column].append(value)
+
+    def add_items(self, study, rows):
+        for row in rows:
+            key = (study, row['file_id'], row['file_order'])
+            self.item_rows[key] = len(self.columns['items']['study'])
+            self.append('items', dict(row, study=study, level=LEVELS[row['file_id'][-1]]))
+
+    def add_ratings(self, study, paths):
+        index = RatingsIndex()
+        index.update(paths)
+        for file_id, file_order, condition_st, rater, judgement in index.ratings():
+            item = self.item_rows.get((study, file_id, file_order))
+            if item is None:
+                logging.warning('Rating of unknown item %s%s-%s by %s in %s.',
+                                condition_st, file_id, file_order, rater, study)
+                continue
+            self.append('ratings', {'study': study, 'item': item, 'condition': condition_st,
+                                    'rater': rater, 'judgement': judgement})
+        index.close()
+
+    def add_errors(self, study, results, items):
+        """Adds error annotations from `results` (rows of
+        `error-analysis/results.csv`), with origins from `items` (rows of
+        `error-analysis/items.csv`)."""
+        origins = error_origins(items)
+        results = list(results)
+        categories = [c for c in (results[0] if results else {}) if c not in NON_CATEGORIES]
+        if self.categories is None:
+            self.categories = categories
+        elif categories != self.categories:
+            raise ValueError('Error categories of {0} differ from those of other studies.'.format(study))
+        width = (len(categories) + 7) // 8
+        for row in results:
+            self.append('errors', {'study': study, 'item': row['Item'], 'example': row['Example'],
+                                   'origin': origins[(row['Item'], row['Example'])]})
+            bits = 0
+            for i, category in enumerate(categories):
+                if row[category].strip() == '1':
+                    bits |= 1 << i
+            self.flags.extend(bits.to_bytes(width, 'little'))
+
+    def close(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {
+            'version': VERSION,
+            'byteorder': sys.byteorder,
+            'dictionaries': {name: d.values for name, d in self.dictionaries.items()},
+            'categories': self.categories or [],
+            'tables': {},
+        }
+        for table, columns in SCHEMA.items():
+            rows = len(self.columns[table]['study'])
+            meta['tables'][table] = {'rows': rows, 'columns': {}}
+            for column, kind, dictionary in columns:
+                values = self.columns[table][column]
+                spec = {'kind': kind}
+                if kind == 'text':
+                    encoded = [v.encode('utf-8') for v in values]
+                    offsets = array('Q', [0])
+                    for value in encoded:
+                        offsets.append(offsets[-1] + len(value))
+                    self.write(table, column, b''.join(encoded))
+                    self.write(table, column + '.offsets', offsets)
+                else:
+                    spec['typecode'] = typecode(max(values, default=0))
+                    self.write(table, column, array(spec['typecode'], values))
+                if kind == 'code':
+                    spec['dictionary'] = dictionary
+                    self.write_index(table, column, values, len(self.dictionaries[dictionary].values)
+                                     if dictionary in self.dictionaries else 0)
+                meta['tables'][table]['columns'][column] = spec
+        self.write('errors', 'flags', bytes(self.flags))
+        with open(os.path.join(self.directory, META), 'w') as f:
+            json.dump(meta, f, indent=1, ensure_ascii=False)
+
+    def write_index(self, table, column, codes, num_codes):
+        """Writes the rows of each code, ordered by code, and the position of
+        the first row of each code."""
+        counts = [0] * (num_codes + 1)
+        for code in codes:
+            counts[code + 1] += 1
+        for code in range(num_codes):
+            counts[code + 1] += counts[code]
+        bounds = array('Q', counts)
+        rows = array(typecode(len(codes)), [0]) * len(codes)
+        position = list(counts[:-1])
+        for row, code in enumerate(codes):
+            rows[position[code]] = row
+            position[code] += 1
+        self.write(table, column + '.rows', rows)
+        self.write(table, column + '.bounds', bounds)
+
+    def write(self, table, name, data):
+        with open(os.path.join(self.directory, '{0}.{1}'.format(table, name)), 'wb') as f:
+            f.write(data)
+
+
+class Table:
+    """A table of a store. Columns are read lazily, as memory-mapped arrays."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.rows = store.meta['tables'][name]['rows']
+        self.spec = store.meta['tables'][name]['columns']
+        self.arrays = {} # file name => sequence, cast once
+        self.texts = {column: (self.column(column, '.offsets'),
+                               store.bytes('{0}.{1}'.format(name, column)))
+                      for column, spec in self.spec.items() if spec['kind'] == 'text'}
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, column, suffix=''):
+        """The integer values (or codes) of `column`, as a sequence."""
+        if suffix in ('.offsets', '.bounds'):
+            code = 'Q'
+        elif suffix == '.rows':
+            code = typecode(self.rows)
+        else:
+            code = self.spec[column]['typecode']
+        name = '{0}.{1}{2}'.format(self.name, column, suffix)
+        if name not in self.arrays:
+            self.arrays[name] = self.store.array(name, code)
+        return self.arrays[name]
+
+    def dictionary(self, column):
+        return self.store.dictionaries[self.spec[column]['dictionary']]
+
+    def code(self, column, value):
+        """The code of `value` in `column`, or None if it does not occur."""
+        return self.dictionary(column).codes.get(value)
+
+    def value(self, column, row):
+        """The value of `column` in `row`, as a string (or int)."""
+        kind = self.spec[column]['kind']
+        if kind == 'text':
+            offsets, data = self.texts[column]
+            return bytes(data[offsets[row]:offsets[row + 1]]).decode('utf-8')
+        value = self.column(column)[row]
+        return self.dictionary(column).values[value] if kind == 'code' else value
+
+    def where(self, column, value):
+        """The rows in which `column` has `value` (or any of several values,
+        if a list), read from the index of `column`."""
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        rows = self.column(column, '.rows')
+        bounds = self.column(column, '.bounds')
+        selected = []
+        for code in sorted(c for c in (self.code(column, v) for v in values) if c is not None):
+            selected.extend(rows[bounds[code]:bounds[code + 1]])
+        return sorted(selected)
+
+    def select(self, **conditions):
+        """Rows matching all `conditions` (column=value or column=[values]).
+        Only the index of the most selective condition is read; the others are
+        checked for these rows only."""
+        if not conditions:
+            return list(range(self.rows))
+        candidates = {column: self.where(column, value) for column, value in conditions.items()}
+        column = min(candidates, key=lambda c: len(candidates[c]))
+        selected = candidates.pop(column)
+        for column, value in conditions.items():
+            if column not in candidates:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            codes = set(self.code(column, v) for v in values)
+            column_codes = self.column(column)
+            selected = [row for row in selected if column_codes[row] in codes]
+        return selected
+
+    def records(self, rows=None, columns=None):
+        """Yields rows as dicts of strings, as if read from CSV."""
+        columns = columns or list(self.spec)
+        for row in (range(self.rows) if rows is None else rows):
+            yield {column: str(self.value(column, row)) for column in columns}
+
+
+class Store:
+    """Read access to a store created by `StoreWriter`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META)) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != VERSION:
+            raise ValueError('Unsupported store version: {0}'.format(self.meta['version']))
+        self.dictionaries = {name: Dictionary(values)
+                             for name, values in self.meta['dictionaries'].items()}
+        self.categories = self.meta['categories']
+        self.mapped = {}
+        self.items = Table(self, 'items')
+        self.ratings = Table(self, 'ratings')
+        self.errors = Table(self, 'errors')
+
+    @property
+    def studies(self):
+        return self.dictionaries['study'].values if 'study' in self.dictionaries else []
+
+    def bytes(self, name):
+        """The content of file `name`, memory-mapped."""
+        if name not in self.mapped:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self.mapped[name] = memoryview(b'')
+                else:
+                    self.mapped[name] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.mapped[name]
+
+    def array(self, name, code):
+        data = self.bytes(name)
+        if self.meta['byteorder'] != sys.byteorder: # copy and swap
+            values = array(code, bytes(data))
+            values.byteswap()
+            return values
+        return data.cast(code)
+
+    def flags(self, row):
+        """The error categories of row `row` of `errors`, as a bit field."""
+        width = (len(self.categories) + 7) // 8
+        data = self.bytes('errors.flags')
+        return int.from_bytes(data[row * width:(row + 1) * width], 'little')
+
+    def error_counts(self, rows=None):
+        """Counts, for `rows` of `errors` (all by default), the rows with
+        each category, and the rows with any error. Returns (dict of category
+        => count, number of rows with any error)."""
+        counts = [0] * len(self.categories)
+        any_error = 0
+        for row in (range(len(self.errors)) if rows is None else rows):
+            bits = self.flags(row)
+            any_error += bits != 0
+            i = 0
+            while bits:
+                if bits & 1:
+                    counts[i] += 1
+                bits >>= 1
+                i += 1
+        return dict(zip(self.categories, counts)), any_error
+
+    def item_rows(self, study=None):
+        """Yields the items of `study` (all studies by default) as in
+        `items.csv`."""
+        rows = None if study is None else self.items.select(study=study)
+        return self.items.records(rows, ITEM_FIELDS)
+
+    def rating_tuples(self, study=None, rows=None):
+        """Yields (file_id, file_order, condition_st, rater, judgement) for
+        each rating of `study` (or in `rows` of `ratings`), like
+        `RatingsIndex.ratings()`."""
+        if rows is None:
+            rows = range(len(self.ratings)) if study is None else self.ratings.select(study=study)
+        items = self.ratings.column('item')
+        for row in rows:
+            item = items[row]
+            yield (self.items.value('file_id', item), str(self.items.value('file_order', item)),
+                   self.ratings.value('condition', row), self.ratings.value('rater', row),
+                   self.ratings.value('judgement', row))
+
+
+class StoreRatings:
+    """The ratings of one study in a store, with the interface of
+    `RatingsIndex` used by `combine_results.py`."""
+
+    def __init__(self, store, study=None):
+        self.store = store
+        self.study = study
+
+    def ratings(self):
+        yield from self.store.rating_tuples(self.study)
+
+    def max_raters(self):
+        counts = {}
+        for file_id, file_order, condition_st, _, _ in self.ratings():
+            key = (file_id, file_order, condition_st)
+            counts[key] = counts.get(key, 0) + 1
+        return max(counts.values(), default=0)
+
+    def close(self):
+        pass
+
+
+def build(directory, studies):
+    """Writes a store of `studies` (dicts as in the manifest) to `directory`.
+    Paths are relative to the working directory."""
+    writer = StoreWriter(directory)
+    for study in studies:
+        name = study['name']
+        writer.add_items(name, read_table(study['items']))
+        if study.get('ratings'):
+            writer.add_ratings(name, ratings_files(study['ratings']))
+        if study.get('errors'):
+            with open(study['errors'], newline='') as f_results, \
+                 open(study['error_items'], newline='') as f_items:
+                writer.add_errors(name, csv.DictReader(f_results), csv.DictReader(f_items))
+    writer.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = ArgumentParser(description='Builds a binary store of items, ratings and error '
+                                        'annotations.')
+    parser.add_argument('manifest', type=FileType('r'), help='The studies (JSON).')
+    parser.add_argument('-o', '--output', default='results.store',
+                        help='Output directory (default: results.store).')
+    args = parser.parse_args()
+
+    studies = json.load(args.manifest)
+    build(args.output, studies)
+    store = Store(args.output)
+    logging.info('%s studies: %s items, %s ratings, %s error annotations.', len(store.studies),
+                 len(store.items), len(store.ratings), len(store.errors))
@@ -0,0 +1,108 @@
+"""Reads and writes the tabular files passed between the scripts in this
+directory (`data.csv`, `items.csv`).
+
+Files ending in `.sqlite` are stored as a single SQLite table, which can be
+queried without re-parsing the whole file; all other files (and `-` for
+stdin/stdout) are CSV. Values are always returned as strings, just like
+`csv.DictReader` does, so both formats can be used interchangeably.
+"""
+
+import os
+import csv
+import sys
+import sqlite3
+
+
+COMPACT_SUFFIX = '.sqlite'
+TABLE = 'rows'
+
+
+def is_compact(path):
+    return path.endswith(COMPACT_SUFFIX)
+
+
+def read_table(path):
+    """Yields each row of a CSV or SQLite file as a dict. Items can also be
+    read from a binary store (see `store.py`)."""
+    if os.path.isfile(os.path.join(path.partition('#')[0], 'meta.json')):
+        from store import open_store # store.py imports this module
+        store, study = open_store(path)
+        yield from store.item_rows(study)
+    elif is_compact(path):
+        connection = sqlite3.connect('file:{0}?mode=ro'.format(path), uri=True)
+        try:
+            cursor = connection.execute('SELECT * FROM {0} ORDER BY rowid'.format(TABLE))
+            fieldnames = [d[0] for d in cursor.description]
+            for row in cursor:
+                yield dict(zip(fieldnames, row))
+        finally:
+            connection.close()
+    elif path == '-':
+        yield from csv.DictReader(sys.stdin)
+    else:
+        with open(path, newline='') as f:
+            yield from csv.DictReader(f)
+
+
+class CountingStream:
+    """Passes text on to `stream` and counts the bytes written."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.encoding = stream.encoding or 'utf-8'
+        self.count = 0
+
+    def write(self, text):
+        self.count += len(text.encode(self.encoding))
+        return self.stream.write(text)
+
+
+class TableWriter:
+    """Writes rows to a CSV or SQLite file. Use as a context manager.
+    `bytes_written` is the size of the output once it is closed."""
+
+    def __init__(self, path, fieldnames):
+        self.path = path
+        self.fieldnames = fieldnames
+
+    def __enter__(self):
+        if is_compact(self.path):
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute('DROP TABLE IF EXISTS {0}'.format(TABLE))
+            self.connection.execute('CREATE TABLE {0} ({1})'.format(
+                TABLE, ', '.join('"{0}" TEXT'.format(f) for f in self.fieldnames)))
+            self.insert = 'INSERT INTO {0} VALUES ({1})'.format(
+                TABLE, ', '.join('?' for _ in self.fieldnames))
+        else:
+            self.file = CountingStream(sys.stdout) if self.path == '-' else open(self.path, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames,
+                                         extrasaction='ignore')
+            self.writer.writeheader()
+        return self
+
+    def writerow(self, row):
+        if is_compact(self.path):
+            self.connection.execute(self.insert, [
+                '' if row.get(f) is None else str(row[f]) for f in self.fieldnames
+            ])
+        else:
+            self.writer.writerow(row)
+
+    def __exit__(self, *exc_info):
+        if is_compact(self.path):
+            self.connection.commit()
+            self.connection.close()
+            self.bytes_written = os.path.getsize(self.path)
+        elif self.path == '-':
+            self.bytes_written = self.file.count
+        else:
+            self.file.close()
+            self.bytes_written = os.path.getsize(self.path)
+
+
+def write_table(path, fieldnames, rows):
+    """Writes `rows` to a CSV or SQLite file (see `TableWriter`)."""
+    with TableWriter(path, fieldnames) as writer:
+        for row in rows:
+            writer.writerow(row)
+    return writer.bytes_written
@@ -0,0 +1,72 @@
+"""Tests the alignment of document-level translations (`scripts/aligner.py`)
+and the items created from them.
+
+Run from `ranking` with `python -m unittest discover tests`.
+"""
+
+import os
+import sys
+import random
+import logging
+import unittest
+
+RANKING = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RANKING, 'scripts'))
+from aligner import DocumentAligner, realign
+from create_experiment import create_experiment
+from design import Design
+
+
+class AlignerTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING) # realignment is logged
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_realign_two_to_one(self):
+        translations = realign(['一二三四五六七八。', '九十一二三四五六。', '七八九十。'],
+                               ['One two three four five six seven eight nine ten eleven.',
+                                'Seven eight nine ten.'])
+        self.assertEqual(translations, ['One two three four five six seven eight nine ten eleven.',
+                                        '', 'Seven eight nine ten.'])
+
+    def test_repeated_source_sentences_align_by_position(self):
+        aligner = DocumentAligner()
+        aligner.add(0, ['你好。', '（完）', '再见。', '（完）'],
+                    ['Hello.', '(End 1)', 'Goodbye.', '(End 2)'])
+        self.assertEqual(aligner.align(0, ['你好。', '（完）', '再见。', '（完）']),
+                         ['Hello.', '(End 1)', 'Goodbye.', '(End 2)'])
+
+    def test_documents_without_order_are_found_by_lookup(self):
+        aligner = DocumentAligner()
+        aligner.add(('row', 0), ['你好。', '再见。'], ['Hello.', 'Goodbye.'])
+        self.assertEqual(aligner.align(7, ['你好。', '再见。']), ['Hello.', 'Goodbye.'])
+
+    def test_two_to_one_documents_give_no_empty_items(self):
+        rng = random.Random(1)
+        aligner = DocumentAligner()
+        rows = []
+        for article in range(40):
+            src = ['{0}-{1}。'.format(article, i) for i in range(4)]
+            if article % 2 == 0: # translated as a document, first two sentences as one
+                aligner.add(article, src, ['Sentences {0}-0 and {0}-1.'.format(article)] +
+                            ['Sentence {0}-{1}.'.format(article, i) for i in range(2, 4)])
+                human_b = aligner.align(article, src)
+            else:
+                human_b = [''] * len(src)
+            for i, sentence in enumerate(src):
+                rows.append({'wmt_article': str(article), 'wmt_line': str(len(rows) + 1),
+                             'wmt_article_name': 'a{0}'.format(article), 'src': sentence,
+                             'mt': 'mt {0}'.format(rng.random()),
+                             'human_a': 'human_a {0}'.format(rng.random()),
+                             'human_b': human_b[i]})
+        design = Design(documents=4, documents_spam=1, sentences=16, sentences_spam=1)
+        items = [item.as_row() for item in create_experiment(rows, design)]
+        self.assertTrue(items)
+        for item in items:
+            self.assertTrue(item['A'] and item['B'], item)
+            self.assertNotIn('  ', item['A'] + item['B'], item)
+
+
+if __name__ == '__main__':
+    unittest.main()
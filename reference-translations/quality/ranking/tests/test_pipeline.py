@@ -0,0 +1,82 @@
+"""Tests that the stage cache of `scripts/pipeline.py` is invalidated by
+changes to any module a stage uses.
+
+Run from `ranking` with `python -m unittest discover tests`.
+"""
+
+import os
+import sys
+import ast
+import shutil
+import tempfile
+import unittest
+
+RANKING = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RANKING, 'scripts'))
+import pipeline
+from stage_cache import StageCache, manifest
+
+
+NOT_CODE = {'instrumentation'} # does not change the output of a stage
+
+
+def local_imports(path):
+    """Names of the modules in `scripts` that the module at `path` imports,
+    including imports inside functions."""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module)
+    return {name for name in names
+            if os.path.exists(os.path.join(RANKING, 'scripts', name + '.py'))}
+
+
+def module_path(name):
+    path = os.path.join(RANKING, 'scripts', name + '.py')
+    return path if os.path.exists(path) else os.path.join(RANKING, name + '.py')
+
+
+class StageCodeTest(unittest.TestCase):
+
+    def test_code_covers_imports(self):
+        for stage in pipeline.STAGES:
+            seen, todo = set(), [stage]
+            while todo:
+                name = todo.pop()
+                if name not in seen:
+                    seen.add(name)
+                    todo.extend(local_imports(module_path(name)))
+            missing = seen - set(pipeline.CODE[stage]) - NOT_CODE
+            self.assertFalse(missing, '{0} uses {1}'.format(stage, ', '.join(sorted(missing))))
+
+    def test_changed_module_invalidates_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runs = []
+        def compute():
+            runs.append(1)
+            return len(runs), []
+        for stage in pipeline.STAGES:
+            for changed in pipeline.CODE[stage]:
+                # copies of the stage's modules, one of which is edited
+                code = os.path.join(directory, 'code-{0}-{1}'.format(stage, changed))
+                os.mkdir(code)
+                paths = [shutil.copy(module_path(name), code) for name in pipeline.CODE[stage]]
+                run = pipeline.Pipeline(cache=StageCache(os.path.join(code, 'cache')))
+                spec = lambda: manifest(stage, code=paths)
+                before = len(runs)
+                run.cached(spec(), compute)
+                run.cached(spec(), compute)
+                self.assertEqual(len(runs), before + 1, stage) # second run is cached
+                with open(os.path.join(code, changed + '.py'), 'a') as f:
+                    f.write('\n# changed\n')
+                run.cached(spec(), compute)
+                self.assertEqual(len(runs), before + 2, '{0}: {1}'.format(stage, changed))
+
+
+if __name__ == '__main__':
+    unittest.main()